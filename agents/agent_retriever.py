@@ -1,36 +1,79 @@
 from typing import List, Dict, Any
 from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import asyncio
 import os
+import time
 
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.chains import create_history_aware_retriever
-from langchain_core.runnables import RunnableWithMessageHistory
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_anthropic import ChatAnthropic
-from langchain_chroma import Chroma
-from langchain_community.chat_message_histories import ChatMessageHistory
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun, AsyncCallbackManagerForRetrieverRun
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableParallel, RunnableWithMessageHistory
+from operator import itemgetter
+from langchain_openai import OpenAIEmbeddings
 from langchain.tools.retriever import create_retriever_tool
 from langchain.tools import BaseTool, tool
 from langchain.agents import AgentExecutor, create_openai_tools_agent, create_tool_calling_agent
 
+from utils.embedding_cache import CachedEmbeddings, DEFAULT_CACHE_DIR, EMBEDDING_DIMENSIONS
+from utils.vector_index import IVFIndex, DEFAULT_INDEX_DIR
+from utils.bm25_index import BM25Index, DEFAULT_BM25_FILE
+from agents.answer_cache import SemanticAnswerCache
+from agents.session_store import StoredChatMessageHistory, create_session_store
+from agents.history_policy import HistoryPolicy, WindowedChatMessageHistory
+from agents.router import QuestionRouter
+
 # Configuration
 # Configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 EMBEDDING_MODEL = "text-embedding-3-large"
 CHROMA_PERSIST_DIRECTORY = 'db'
+# "chroma", or "local" for the in-process IVF index exported with utils/vector_index.py
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+VECTOR_INDEX_DIRECTORY = os.getenv("VECTOR_INDEX_DIRECTORY", DEFAULT_INDEX_DIR)
+VECTOR_INDEX_NPROBE = int(os.getenv("VECTOR_INDEX_NPROBE", 0)) or None
+# candidates per result re-ranked at full precision when the index is int8 or binary quantized
+VECTOR_INDEX_RESCORE = int(os.getenv("VECTOR_INDEX_RESCORE", 0)) or None
+# "hybrid" fuses the vector search with the BM25 index built by utils/ingest.py, "vector" is similarity only;
+# hybrid falls back to vector when the index file is missing
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+BM25_INDEX_PATH = os.getenv("BM25_INDEX_PATH", os.path.join(CHROMA_PERSIST_DIRECTORY, DEFAULT_BM25_FILE))
+# candidates taken from each search before fusion, and the RRF damping constant
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", 20))
+RRF_K = int(os.getenv("RRF_K", 60))
+EMBEDDING_CACHE_DIRECTORY = os.getenv("EMBEDDING_CACHE_DIRECTORY", DEFAULT_CACHE_DIR)
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", 8))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 24 * 3600))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 1000))
+AGENT_VERBOSE = os.getenv("AGENT_VERBOSE", "false").lower() in ["true", "1", "y", "yes", "on"]
+# follow-up questions are rewritten by a small model, the main model only answers
+CONTEXTUALIZE_MODELS = {"openai": "gpt-4o-mini", "anthropic": "claude-3-haiku-20240307"}
+CONTEXTUALIZE_MODEL = os.getenv("CONTEXTUALIZE_MODEL")
+CONTEXTUALIZE_CACHE_SIZE = int(os.getenv("CONTEXTUALIZE_CACHE_SIZE", 1000))
 
 class LLMFactory:
     @staticmethod
     def create_llm(provider: str, model: str):
+        # provider SDKs are imported on demand, only the configured one is ever loaded
         if provider == "openai":
+            from langchain_openai import ChatOpenAI
             return ChatOpenAI(model=model, openai_api_key=OPENAI_API_KEY)
         elif provider == "anthropic":
+            from langchain_anthropic import ChatAnthropic
             return ChatAnthropic(model=model, anthropic_api_key=ANTHROPIC_API_KEY)
         else:
             raise ValueError(f"Unsupported LLM provider: {provider}")
 
 class VectorStore(ABC):
+    # blocking searches (embedding call + index lookup) run on this bounded pool when awaited
+    executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+
     @abstractmethod
     def as_retriever(self, **kwargs):
         pass
@@ -39,16 +82,120 @@ class VectorStore(ABC):
     def similarity_search_with_score(self, query: str, k: int):
         pass
 
+    async def asimilarity_search_with_score(self, query: str, k: int):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.similarity_search_with_score, query, k)
+
+    def version(self):
+        # changes whenever the indexed content does, answers cached before that are stale
+        return None
+
+class VectorStoreRetriever(BaseRetriever):
+    # similarity retriever over any VectorStore; the async path never blocks the event loop
+    vector_store: Any
+    k: int = 6
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return [doc for doc, _ in self.vector_store.similarity_search_with_score(query, self.k)]
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        return [doc for doc, _ in await self.vector_store.asimilarity_search_with_score(query, self.k)]
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], k: int, rrf_k: int = 60) -> List[Document]:
+    # each ranking adds 1 / (rrf_k + rank) to a chunk; ranks are comparable where raw BM25 and cosine scores are not
+    scores: Dict[str, float] = {}
+    documents: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = doc.metadata.get("chunk_id") or doc.page_content
+            scores[key] = scores.get(key, 0.0) + 1 / (rrf_k + rank)
+            documents.setdefault(key, doc)
+    return [documents[key] for key in sorted(scores, key=scores.get, reverse=True)[:k]]
+
+class HybridRetriever(BaseRetriever):
+    # vector and BM25 searches run concurrently on the retrieval pool and are fused with RRF, so exact
+    # names (supplements, compounds, guests) that embeddings blur still reach the top k
+    vector_store: Any
+    lexical_index: Any
+    k: int = 6
+    candidates: int = 20
+    rrf_k: int = 60
+
+    def _lexical_search(self, query: str) -> List[Document]:
+        return [Document(page_content=content, metadata=metadata)
+                for _, content, metadata, _ in self.lexical_index.search(query, self.candidates)]
+
+    def _fuse(self, vector_hits, lexical_hits) -> List[Document]:
+        return reciprocal_rank_fusion([[doc for doc, _ in vector_hits], lexical_hits], self.k, self.rrf_k)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        lexical = self.vector_store.executor.submit(self._lexical_search, query)
+        vector_hits = self.vector_store.similarity_search_with_score(query, self.candidates)
+        return self._fuse(vector_hits, lexical.result())
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        loop = asyncio.get_running_loop()
+        vector_hits, lexical_hits = await asyncio.gather(
+            self.vector_store.asimilarity_search_with_score(query, self.candidates),
+            loop.run_in_executor(self.vector_store.executor, self._lexical_search, query))
+        return self._fuse(vector_hits, lexical_hits)
+
 class ChromaVectorStore(VectorStore):
     def __init__(self, persist_directory: str, embedding_function):
+        from langchain_chroma import Chroma
+        self.persist_directory = persist_directory
         self.db = Chroma(persist_directory=persist_directory, embedding_function=embedding_function)
 
     def as_retriever(self, **kwargs):
-        return self.db.as_retriever(**kwargs)
+        search_type = kwargs.get("search_type", "similarity")
+        if search_type != "similarity":
+            return self.db.as_retriever(**kwargs)
+        return VectorStoreRetriever(vector_store=self, k=kwargs.get("search_kwargs", {}).get("k", 4))
 
     def similarity_search_with_score(self, query: str, k: int):
         return self.db.similarity_search_with_score(query, k=k)
 
+    def version(self):
+        try:
+            return os.stat(os.path.join(self.persist_directory, "ingest_version")).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+class LocalVectorStore(VectorStore):
+    # in-process IVF index over a memory-mapped matrix, no client round trip per query;
+    # picks up a re-export on the next search
+    def __init__(self, directory: str, embedding_function, nprobe: int = None, rescore: int = None):
+        self.index = IVFIndex(directory)
+        self.embedding_function = embedding_function
+        self.nprobe = nprobe
+        self.rescore = rescore
+
+    def as_retriever(self, **kwargs):
+        return VectorStoreRetriever(vector_store=self, k=kwargs.get("search_kwargs", {}).get("k", 4))
+
+    def similarity_search_with_score(self, query: str, k: int):
+        vector = self.embedding_function.embed_query(query)
+        # one snapshot for both steps, so the rows are looked up in the generation that produced them
+        snapshot = self.index.current()
+        hits = snapshot.search(vector, k, self.nprobe, self.rescore)
+        found = snapshot.documents([row for row, _ in hits])
+        # cosine distance, so that lower is closer as with Chroma
+        return [(Document(page_content=found[row][1], metadata=found[row][2]), 1 - score)
+                for row, score in hits if row in found]
+
+    def version(self):
+        return self.index.current().version
+
+class VectorStoreFactory:
+    @staticmethod
+    def create_vector_store(backend: str, embedding_function) -> VectorStore:
+        if backend == "chroma":
+            return ChromaVectorStore(CHROMA_PERSIST_DIRECTORY, embedding_function)
+        elif backend == "local":
+            return LocalVectorStore(VECTOR_INDEX_DIRECTORY, embedding_function, VECTOR_INDEX_NPROBE, VECTOR_INDEX_RESCORE)
+        else:
+            raise ValueError(f"Unsupported vector backend: {backend}")
+
 class ToolFactory:
     @staticmethod
     def create_retriever_tool(retriever):
@@ -86,6 +233,7 @@ class PromptBuilder:
         system_prompt = """
             Given a chat history and the user's most recent question, which may reference the context in the chat history,
             formulate an independent question that can be understood without the chat history.
+            Do not answer the question, only return it reformulated, or as it is if it is already standalone.
             """
         return ChatPromptTemplate.from_messages([
             ("system", system_prompt),
@@ -99,6 +247,7 @@ class PromptBuilder:
             You are HubeGPT, a friendly AI assistant that helps people with their questions and concerns about science.
             You are very friendly, care about people's well-being, and like to use emojis.
             Use the information provided in the chat history to give a helpful and accurate response to the user's question.
+            When you search the videos, search for this standalone version of the user's question: {question}
             """
         return ChatPromptTemplate.from_messages([
             ("system", system_prompt),
@@ -107,15 +256,79 @@ class PromptBuilder:
             MessagesPlaceholder('agent_scratchpad')
         ])
 
+    @staticmethod
+    def build_direct_prompt():
+        system_prompt = """
+            You are HubeGPT, a friendly AI assistant that helps people with their questions and concerns about science.
+            You are very friendly, care about people's well-being, and like to use emojis.
+            Answer the user's question using the excerpts from transcribed YouTube videos below and the chat history.
+            Limit your response to a maximum of 3 sentences, ensuring precision and relevance to the user's query.
+
+            Excerpts:
+            {context}
+            """
+        return ChatPromptTemplate.from_messages([
+            ("system", system_prompt),
+            MessagesPlaceholder("chat_history"),
+            ("human", "{input}"),
+        ])
+
+def format_documents(documents: List[Document]) -> str:
+    return "\n\n".join(doc.page_content for doc in documents)
+
 class HubeGPT:
     def __init__(self, provider: str, model: str):
-        self.embedding_model = OpenAIEmbeddings(model=EMBEDDING_MODEL, openai_api_key=OPENAI_API_KEY)
-        self.vector_store = ChromaVectorStore(CHROMA_PERSIST_DIRECTORY, self.embedding_model)
-        self.llm = LLMFactory.create_llm(provider, model)
-        self.retriever = self.vector_store.as_retriever(search_type="similarity", search_kwargs={"k": 6})
-        self.tools = self._setup_tools()
-        self.agent_executor = self._setup_agent()
-        self.chat_history_store: Dict[str, ChatMessageHistory] = {}
+        # seconds spent in each startup phase, reported by the readiness endpoint
+        self.startup_timings: Dict[str, float] = {}
+        with self._phase("embeddings"):
+            self.embedding_model = CachedEmbeddings(
+                OpenAIEmbeddings(model=EMBEDDING_MODEL, openai_api_key=OPENAI_API_KEY, dimensions=EMBEDDING_DIMENSIONS),
+                EMBEDDING_MODEL, EMBEDDING_CACHE_DIRECTORY, EMBEDDING_DIMENSIONS)
+        with self._phase("vector_store"):
+            self.vector_store = VectorStoreFactory.create_vector_store(VECTOR_BACKEND, self.embedding_model)
+            self.lexical_index = None
+            if RETRIEVAL_MODE == "hybrid" and os.path.exists(BM25_INDEX_PATH):
+                self.lexical_index = BM25Index(BM25_INDEX_PATH)
+        with self._phase("llm"):
+            self.llm = LLMFactory.create_llm(provider, model)
+            self.contextualizer = (PromptBuilder.build_contextualize_prompt()
+                                   | LLMFactory.create_llm(provider, CONTEXTUALIZE_MODEL or CONTEXTUALIZE_MODELS[provider])
+                                   | StrOutputParser())
+        self._contextualized: "OrderedDict[tuple, list]" = OrderedDict()
+        self.contextualize_counts = Counter()
+        with self._phase("agent"):
+            if self.lexical_index is not None:
+                self.retriever = HybridRetriever(vector_store=self.vector_store, lexical_index=self.lexical_index, k=6,
+                                                 candidates=HYBRID_CANDIDATES, rrf_k=RRF_K)
+            else:
+                self.retriever = self.vector_store.as_retriever(search_type="similarity", search_kwargs={"k": 6})
+            self.tools = self._setup_tools()
+            self.agent_executor = self._setup_agent()
+            self.direct_chain = self._setup_direct_chain()
+            self.router = QuestionRouter()
+        with self._phase("stores"):
+            self.chat_history_store = create_session_store("history")
+            self.history_policy = HistoryPolicy(model, create_session_store("summaries"), llm=self.llm)
+            self.answer_cache = SemanticAnswerCache(ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL, ANSWER_CACHE_SIZE,
+                                                    version=self.ingest_version)
+
+    @contextmanager
+    def _phase(self, name: str):
+        start = time.perf_counter()
+        yield
+        self.startup_timings[name] = round(time.perf_counter() - start, 3)
+        print(f"[startup] {name}: {self.startup_timings[name]:.3f}s")
+
+    def warm_up(self):
+        # one throwaway search loads the vector index and opens the embedding client's connection
+        # before the first user waits on them; the query's embedding is cached after the first start
+        with self._phase("warmup"):
+            self.vector_store.similarity_search_with_score("warmup", k=1)
+            if self.lexical_index is not None:
+                self.lexical_index.search("warmup", 1)
+
+    def ingest_version(self):
+        return self.vector_store.version()
 
     def _setup_tools(self) -> List[BaseTool]:
         tool_factory = ToolFactory()
@@ -127,22 +340,72 @@ class HubeGPT:
 
     def _setup_agent(self) -> AgentExecutor:
         prompt_builder = PromptBuilder()
-        contextualize_prompt = prompt_builder.build_contextualize_prompt()
         qa_prompt = prompt_builder.build_qa_prompt()
 
-        history_aware_retriever = create_history_aware_retriever(
-            self.llm, self.retriever, contextualize_prompt
-        )
-
         #agent = create_openai_tools_agent(self.llm, self.tools, qa_prompt)
         agent = create_tool_calling_agent(self.llm, self.tools, qa_prompt)
         
-        return AgentExecutor(agent=agent, tools=self.tools, verbose=True, return_intermediate_steps=True)
+        return AgentExecutor(agent=agent, tools=self.tools, verbose=AGENT_VERBOSE, return_intermediate_steps=True)
+
+    def _setup_direct_chain(self):
+        # retrieve-then-answer in a single LLM call for questions that clearly need the video corpus
+        retrieval = RunnableParallel(
+            context=itemgetter("question") | self.retriever | format_documents,
+            input=itemgetter("input"),
+            chat_history=itemgetter("chat_history"),
+        )
+        return retrieval | PromptBuilder.build_direct_prompt() | self.llm
 
-    def get_session_history(self, session_id: str) -> ChatMessageHistory:
-        if session_id not in self.chat_history_store:
-            self.chat_history_store[session_id] = ChatMessageHistory()
-        return self.chat_history_store[session_id]
+    def get_session_history(self, session_id: str) -> WindowedChatMessageHistory:
+        return WindowedChatMessageHistory(self.chat_history_store, session_id, self.history_policy)
+
+    def contextualize(self, session_id: str, question: str) -> asyncio.Future:
+        # starts rewriting a follow-up into a standalone question, so callers can kick it off as soon as
+        # the question arrives and await it later; one rewrite per (session, turn), a first turn needs none
+        stored = self.chat_history_store.get(session_id) or []
+        return self._contextualize_entry(session_id, question, stored)[0]
+
+    def _contextualize_entry(self, session_id: str, question: str, stored: list) -> list:
+        # [future, awaited]: awaited is set by the first turn that used the rewrite
+        if not stored:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(question)
+            return [future, False]
+        key = (session_id, len(stored), question)
+        entry = self._contextualized.get(key)
+        if entry is not None:
+            self._contextualized.move_to_end(key)
+            return entry
+        task = asyncio.get_running_loop().create_task(self.contextualizer.ainvoke({
+            "input": question,
+            "chat_history": self.get_session_history(session_id).messages,
+        }))
+        entry = self._contextualized[key] = [task, False]
+        while len(self._contextualized) > CONTEXTUALIZE_CACHE_SIZE:
+            self._contextualized.popitem(last=False)
+        return entry
+
+    async def acontextualize(self, session_id: str, question: str) -> str:
+        # counted here, once per turn: a prefetch started by contextualize() is not a cache hit
+        stored = self.chat_history_store.get(session_id) or []
+        entry = self._contextualize_entry(session_id, question, stored)
+        if not stored:
+            self.contextualize_counts["skipped"] += 1
+        elif entry[1]:
+            self.contextualize_counts["cached"] += 1
+        else:
+            self.contextualize_counts["rewritten"] += 1
+            entry[1] = True
+        try:
+            return (await entry[0]).strip() or question
+        except Exception:
+            # a failed rewrite only costs retrieval quality, answer with the raw question
+            self._contextualized.pop((session_id, len(stored), question), None)
+            return question
+
+    def after_turn(self, session_id: str):
+        # rolling summary of turns that left the window, computed off the request path
+        self.history_policy.schedule_summary(session_id, StoredChatMessageHistory(self.chat_history_store, session_id).messages)
 
     def agent_runner(self):
         return RunnableWithMessageHistory(
@@ -153,9 +416,33 @@ class HubeGPT:
             history_messages_key="chat_history",
         )
 
+    def direct_runner(self):
+        return RunnableWithMessageHistory(
+            self.direct_chain,
+            self.get_session_history,
+            input_messages_key="input",
+            history_messages_key="chat_history",
+        )
+
+    def route(self, question: str) -> str:
+        return self.router.route(question)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "routes": self.router.metrics(),
+            "contextualize": dict(self.contextualize_counts),
+            "answer_cache": self.answer_cache.stats(),
+            "embedding_cache": self.embedding_model.stats(),
+        }
+
     def get_relevant_documents(self, query: str):
+        # similarity scores of the vector search alone, the hybrid path goes through self.retriever
         return self.vector_store.similarity_search_with_score(query, k=6)
 
+    async def alookup_answer(self, question: str):
+        vector = await self.embedding_model.aembed_query(question)
+        return vector, self.answer_cache.lookup(vector)
+
 # Usage
 
 # OpenAI configuration
@@ -0,0 +1,88 @@
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+import itertools
+import threading
+import time
+
+import numpy as np
+
+class SemanticAnswerCache:
+    # answers keyed by the embedding of the standalone question; a lookup hits when the
+    # cosine similarity to a stored question reaches `threshold`
+    def __init__(self, threshold: float = 0.95, ttl: float = 24 * 3600, max_entries: int = 1000,
+                 version: Optional[Callable[[], object]] = None):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version = version or (lambda: None)
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, Dict]" = OrderedDict()
+        self._vectors = {}
+        self._matrix = None
+        self._keys: List[int] = []
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._current_version = self.version()
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_version(self):
+        # a new ingest can change the right answer, so drop everything when the store version moves
+        version = self.version()
+        if version != self._current_version:
+            self._current_version = version
+            self._entries.clear()
+            self._vectors.clear()
+            self._matrix = None
+
+    def _evict(self, key: int):
+        del self._entries[key]
+        del self._vectors[key]
+        self._matrix = None
+
+    def lookup(self, vector) -> Optional[Dict]:
+        if self.max_entries <= 0:
+            return None
+        query = self._normalize(vector)
+        with self._lock:
+            self._check_version()
+            now = time.time()
+            for key in [key for key, entry in self._entries.items() if now - entry["created"] > self.ttl]:
+                self._evict(key)
+            if not self._entries:
+                self.misses += 1
+                return None
+            if self._matrix is None:
+                self._keys = list(self._entries)
+                self._matrix = np.stack([self._vectors[key] for key in self._keys])
+            scores = self._matrix @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+            key = self._keys[best]
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+    def store(self, vector, question: str, answer: str, sources: List[str]):
+        if self.max_entries <= 0 or not answer:
+            return
+        with self._lock:
+            self._check_version()
+            key = next(self._ids)
+            self._entries[key] = {"question": question, "answer": answer, "sources": sources, "created": time.time()}
+            self._vectors[key] = self._normalize(vector)
+            self._matrix = None
+            while len(self._entries) > self.max_entries:
+                self._evict(next(iter(self._entries)))
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return f"answer cache: {len(self._entries)} entries, {self.hits} hits, {self.misses} misses ({rate:.0%} hit rate)"
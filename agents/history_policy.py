@@ -0,0 +1,106 @@
+from typing import List, Optional
+import asyncio
+import os
+
+import tiktoken
+from langchain_core.messages import BaseMessage, HumanMessage, message_to_dict
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+from agents.session_store import SessionStore, StoredChatMessageHistory
+from agents.streaming import message_text
+
+HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", 2000))
+HISTORY_SUMMARIZE = os.getenv("HISTORY_SUMMARIZE", "false").lower() in ["true", "1", "y", "yes", "on"]
+
+SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """
+        Summarize the conversation below in a few sentences, keeping names, numbers and recommendations.
+        Merge it with the existing summary if there is one.
+        Existing summary: {summary}
+        """),
+    MessagesPlaceholder("messages"),
+])
+
+class HistoryPolicy:
+    # keeps the prompt's chat history under max_tokens: the newest turns verbatim, older turns
+    # only through a rolling summary that is refreshed in the background after a reply
+    def __init__(self, model: str, summary_store: SessionStore, llm=None, max_tokens: int = HISTORY_MAX_TOKENS,
+                 summarize: bool = HISTORY_SUMMARIZE):
+        try:
+            self.encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            self.encoding = tiktoken.get_encoding("cl100k_base")
+        self.summary_store = summary_store
+        self.llm = llm
+        self.max_tokens = max_tokens
+        self.summarize = summarize and llm is not None
+        self._pending = set()
+
+    def count_tokens(self, message: BaseMessage) -> int:
+        # a few tokens of per-message framing on top of the content
+        return len(self.encoding.encode(message_text(message))) + 4
+
+    def window_start(self, messages: List[BaseMessage]) -> int:
+        budget = self.max_tokens
+        start = len(messages)
+        while start > 0:
+            cost = self.count_tokens(messages[start - 1])
+            if cost > budget:
+                break
+            budget -= cost
+            start -= 1
+        # never open the window on an orphaned AI reply
+        while start < len(messages) and not isinstance(messages[start], HumanMessage):
+            start += 1
+        return start
+
+    def get_summary(self, session_id: str) -> Optional[dict]:
+        stored = self.summary_store.get(session_id)
+        return stored[0] if stored else None
+
+    def apply(self, session_id: str, messages: List[BaseMessage]) -> List[BaseMessage]:
+        start = self.window_start(messages)
+        window = messages[start:]
+        summary = self.get_summary(session_id) if start > 0 else None
+        if summary is not None:
+            # a human turn rather than a second system message, which Anthropic rejects mid-conversation
+            window = [HumanMessage(f"Summary of our earlier conversation: {summary['text']}")] + window
+        return window
+
+    def schedule_summary(self, session_id: str, messages: List[BaseMessage]):
+        # called after a reply has been streamed, never on the request path
+        if not self.summarize or session_id in self._pending:
+            return
+        start = self.window_start(messages)
+        if start == 0:
+            return
+        self._pending.add(session_id)
+        task = asyncio.get_running_loop().create_task(self._summarize(session_id, messages[:start]))
+        task.add_done_callback(lambda _: self._pending.discard(session_id))
+
+    async def _summarize(self, session_id: str, dropped: List[BaseMessage]):
+        summary = self.get_summary(session_id)
+        # only the messages that fell out of the window since the last summary are new
+        if summary is not None:
+            covered = summary["last"]
+            for i in range(len(dropped) - 1, -1, -1):
+                if message_to_dict(dropped[i]) == covered:
+                    dropped = dropped[i + 1:]
+                    break
+        if not dropped:
+            return
+        result = await (SUMMARY_PROMPT | self.llm).ainvoke({
+            "summary": summary["text"] if summary else "none",
+            "messages": dropped,
+        })
+        self.summary_store.set(session_id, [{"text": message_text(result), "last": message_to_dict(dropped[-1])}])
+
+class WindowedChatMessageHistory(StoredChatMessageHistory):
+    # what the agent sees: the stored history cut down by the policy; writes still keep everything
+    def __init__(self, store: SessionStore, session_id: str, policy: HistoryPolicy):
+        super().__init__(store, session_id)
+        self.policy = policy
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        return self.policy.apply(self.session_id, super().messages)
@@ -0,0 +1,37 @@
+from collections import Counter
+import re
+
+# questions that need one of the non-retrieval tools, or no tool at all
+AGENT_PATTERNS = [
+    r"\b(event|events|evento|eventos|tour|tickets?|live show)\b",
+    r"\b(sport|sports|deporte|deportes|football|soccer|basketball|tennis)\b",
+]
+SMALL_TALK = re.compile(
+    r"^\s*(hi|hello|hey|hola|thanks|thank you|gracias|ok|okay|bye|adios|good (morning|afternoon|evening)|"
+    r"how are you|como estas|who are you|what can you do)\b[\s!?.,]*$",
+    re.IGNORECASE,
+)
+
+class QuestionRouter:
+    # cheap local decision: corpus questions go straight to retrieve-then-answer (one LLM call),
+    # anything that may need another tool or no retrieval falls back to the tool-calling agent
+    DIRECT = "direct"
+    AGENT = "agent"
+
+    def __init__(self, min_words: int = 3):
+        self.min_words = min_words
+        self.agent_patterns = [re.compile(pattern, re.IGNORECASE) for pattern in AGENT_PATTERNS]
+        self.counts = Counter()
+
+    def route(self, question: str) -> str:
+        if SMALL_TALK.match(question) or len(question.split()) < self.min_words:
+            path = self.AGENT
+        elif any(pattern.search(question) for pattern in self.agent_patterns):
+            path = self.AGENT
+        else:
+            path = self.DIRECT
+        self.counts[path] += 1
+        return path
+
+    def metrics(self) -> dict:
+        return dict(self.counts)
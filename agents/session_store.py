@@ -0,0 +1,152 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import List, Optional, Sequence
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, messages_from_dict, messages_to_dict
+
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_DB = os.getenv("SESSION_DB", "sessions.sqlite")
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", 10000))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", 24 * 3600))
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", 200))
+
+class SessionStore(ABC):
+    # per-session lists of JSON-serializable items, with LRU / idle-TTL eviction and a per-session cap;
+    # callers always write back with set(), so backends are free to hand out copies
+    def __init__(self, max_sessions: int, idle_ttl: float, max_items: int):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_items = max_items
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[List]:
+        pass
+
+    @abstractmethod
+    def set(self, session_id: str, items: List):
+        pass
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        pass
+
+    def _trim(self, items: List) -> List:
+        return items[-self.max_items:] if len(items) > self.max_items else items
+
+class InMemorySessionStore(SessionStore):
+    def __init__(self, max_sessions: int = MAX_SESSIONS, idle_ttl: float = SESSION_IDLE_TTL,
+                 max_items: int = SESSION_MAX_MESSAGES):
+        super().__init__(max_sessions, idle_ttl, max_items)
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float):
+        # least recently used first, so the idle sessions are all at the front
+        while self._sessions:
+            session_id, (_, last_used) = next(iter(self._sessions.items()))
+            if now - last_used <= self.idle_ttl:
+                break
+            del self._sessions[session_id]
+
+    def get(self, session_id: str) -> Optional[List]:
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            if session_id not in self._sessions:
+                return None
+            items, _ = self._sessions[session_id]
+            self._sessions[session_id] = (items, now)
+            self._sessions.move_to_end(session_id)
+            return items
+
+    def set(self, session_id: str, items: List):
+        with self._lock:
+            now = time.time()
+            self._sessions[session_id] = (self._trim(items), now)
+            self._sessions.move_to_end(session_id)
+            self._expire(now)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+class SQLiteSessionStore(SessionStore):
+    # keeps sessions outside the worker process; several workers can share one file
+    def __init__(self, namespace: str, path: str = SESSION_DB, max_sessions: int = MAX_SESSIONS,
+                 idle_ttl: float = SESSION_IDLE_TTL, max_items: int = SESSION_MAX_MESSAGES):
+        super().__init__(max_sessions, idle_ttl, max_items)
+        self.namespace = namespace
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sessions (namespace TEXT, session_id TEXT, data TEXT, "
+                           "updated REAL, PRIMARY KEY (namespace, session_id))")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (namespace, updated)")
+
+    def get(self, session_id: str) -> Optional[List]:
+        with self._lock:
+            now = time.time()
+            row = self._conn.execute("SELECT data, updated FROM sessions WHERE namespace = ? AND session_id = ?",
+                                     (self.namespace, session_id)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.idle_ttl:
+                self._conn.execute("DELETE FROM sessions WHERE namespace = ? AND session_id = ?", (self.namespace, session_id))
+                return None
+            self._conn.execute("UPDATE sessions SET updated = ? WHERE namespace = ? AND session_id = ?",
+                               (now, self.namespace, session_id))
+            return json.loads(row[0])
+
+    def set(self, session_id: str, items: List):
+        with self._lock:
+            now = time.time()
+            self._conn.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?)",
+                               (self.namespace, session_id, json.dumps(self._trim(items)), now))
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._evict(now)
+
+    def _evict(self, now: float):
+        self._conn.execute("DELETE FROM sessions WHERE namespace = ? AND updated < ?", (self.namespace, now - self.idle_ttl))
+        self._conn.execute("DELETE FROM sessions WHERE namespace = ? AND session_id IN (SELECT session_id FROM sessions "
+                           "WHERE namespace = ? ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+                           (self.namespace, self.namespace, self.max_sessions))
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE namespace = ? AND session_id = ?", (self.namespace, session_id))
+
+def create_session_store(namespace: str) -> SessionStore:
+    if SESSION_BACKEND == "memory":
+        return InMemorySessionStore()
+    elif SESSION_BACKEND == "sqlite":
+        return SQLiteSessionStore(namespace)
+    else:
+        raise ValueError(f"Unsupported session backend: {SESSION_BACKEND}")
+
+class StoredChatMessageHistory(BaseChatMessageHistory):
+    # LangChain chat history backed by a SessionStore, used by RunnableWithMessageHistory
+    def __init__(self, store: SessionStore, session_id: str):
+        self.store = store
+        self.session_id = session_id
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        return messages_from_dict(self.store.get(self.session_id) or [])
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        stored = list(self.store.get(self.session_id) or [])
+        stored.extend(messages_to_dict(messages))
+        self.store.set(self.session_id, stored)
+
+    def clear(self) -> None:
+        self.store.delete(self.session_id)
@@ -0,0 +1,25 @@
+from typing import Any, AsyncIterator, Dict, Tuple
+
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import Runnable
+
+TOKEN = "token"
+DOCUMENTS = "documents"
+
+def message_text(message: BaseMessage) -> str:
+    # OpenAI messages carry a string, Anthropic ones a list of content blocks; tool call blocks carry no text
+    if isinstance(message.content, str):
+        return message.content
+    return "".join(part.get("text", "") for part in message.content if isinstance(part, dict))
+
+async def astream_answer(runnable: Runnable, inputs: Dict[str, Any], config: Dict[str, Any]) -> AsyncIterator[Tuple[str, Any]]:
+    # yields (TOKEN, text) for every piece of answer text and (DOCUMENTS, [Document]) for every retrieval,
+    # for any provider; only chat model and retriever runs are traced, the rest of the chain emits nothing
+    events = runnable.astream_events(inputs, config=config, version="v2", include_types=["chat_model", "retriever"])
+    async for event in events:
+        if event["event"] == "on_chat_model_stream":
+            text = message_text(event["data"]["chunk"])
+            if text:
+                yield TOKEN, text
+        elif event["event"] == "on_retriever_end":
+            yield DOCUMENTS, event["data"]["output"]
@@ -0,0 +1,68 @@
+# compares the single-pass caption cleaners (plain and timed) with the original multi-pass regex cleaner
+# usage: python benchmarks/bench_cleanup.py [--hours 3] [--repeat 3]
+import os
+import sys
+import glob
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from downloader import Downloader
+
+WORDS = 'sleep light dopamine caffeine protocol cortisol morning exercise focus the and of to is that'.split()
+
+def timestamp(ms):
+  return f'{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d}.{ms % 1000:03d}'
+
+def synthetic_vtt(hours, seed=0):
+  # mimics YouTube auto captions: every cue repeats the previous line and adds a tagged one
+  rng = random.Random(seed)
+  lines = ['WEBVTT', 'Kind: captions', 'Language: en', '']
+  previous = ''
+  for ms in range(0, hours * 3600000, 2000):
+    words = [rng.choice(WORDS) for _ in range(8)]
+    tagged = words[0] + ''.join(f'<{timestamp(ms + 200 * i)}><c> {w}</c>' for i, w in enumerate(words[1:]))
+    lines.append(f'{timestamp(ms)} --> {timestamp(ms + 2000)} align:start position:0%')
+    lines.append(previous)
+    lines.append(tagged if rng.random() > 0.02 else '[Music]')
+    lines.append('')
+    previous = ' '.join(words)
+  return '\n'.join(lines) + '\n'
+
+def bench(fn, text, repeat):
+  best = float('inf')
+  for _ in range(repeat):
+    start = time.perf_counter()
+    result = fn(text)
+    best = min(best, time.perf_counter() - start)
+  return result, best
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--hours', type=int, default=3)
+  parser.add_argument('--repeat', type=int, default=3)
+  parser.add_argument('--captions', default='captions')
+  args = parser.parse_args()
+
+  downloader = Downloader()
+  samples = [(f'synthetic {args.hours}h', synthetic_vtt(args.hours))]
+  samples += [(os.path.basename(f), open(f).read()) for f in sorted(glob.glob(f'{args.captions}/*.original.vtt'))[:20]]
+
+  total_old = total_new = total_timed = 0
+  for name, text in samples:
+    old, old_time = bench(downloader._cleanup_captions_regex, text, args.repeat)
+    new, new_time = bench(downloader._cleanup_captions, text, args.repeat)
+    # the download path writes the timed variant, its text must match too
+    (timed, _), timed_time = bench(downloader._cleanup_timed_captions, text, args.repeat)
+    if old != new or old != timed:
+      print(f'MISMATCH on {name}')
+      sys.exit(1)
+    total_old += old_time
+    total_new += new_time
+    total_timed += timed_time
+    print(f'{name:40s} {len(text) / 1e6:6.2f} MB  regex {old_time * 1000:8.1f} ms  single-pass {new_time * 1000:8.1f} ms  x{old_time / new_time:.1f}  timed {timed_time * 1000:8.1f} ms')
+  print(f'{"total":40s} {"":9s}  regex {total_old * 1000:8.1f} ms  single-pass {total_new * 1000:8.1f} ms  x{total_old / total_new:.1f}  timed {total_timed * 1000:8.1f} ms')
+
+if __name__ == '__main__':
+  main()
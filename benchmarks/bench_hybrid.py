@@ -0,0 +1,102 @@
+# Hit rate and latency of vector, BM25 and hybrid (RRF) retrieval on a fixed query set.
+# Queries come from a JSON file of {"query": ..., "chunk_ids": [...]} or, by default, are generated from
+# the corpus with a fixed seed: the two rarest words of a sampled chunk, the way a question names a
+# supplement or a guest, with every chunk containing both words counted as a hit. Query embeddings are
+# computed (and cached) before timing, so latency is the retrieval itself.
+#
+#   python utils/bm25_index.py --db db                        # once, for a store ingested before the index
+#   python benchmarks/bench_hybrid.py --db db
+#   python benchmarks/bench_hybrid.py --db db --queries queries.json --save queries.json
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import agents.agent_retriever as agent_retriever
+from utils.bm25_index import BM25Index, DEFAULT_BM25_FILE, STOPWORDS
+
+def corpus_words(content):
+    return {word for word in re.findall(r"[a-z]+", content.lower()) if len(word) > 3 and word not in STOPWORDS}
+
+def generate_queries(path, count, seed=0):
+    with sqlite3.connect(path) as conn:
+        chunks = conn.execute("SELECT chunk_id, content FROM chunks ORDER BY chunk_id").fetchall()
+    words = [corpus_words(content) for _, content in chunks]
+    frequency = Counter(word for chunk_words in words for word in chunk_words)
+    rng = np.random.default_rng(seed)
+    queries = []
+    for position in rng.permutation(len(chunks)):
+        # words seen once are mostly transcription noise, a real question would not contain them
+        rare = sorted((word for word in words[position] if frequency[word] > 1), key=lambda word: (frequency[word], word))[:2]
+        if len(rare) < 2:
+            continue
+        hits = [chunks[i][0] for i, chunk_words in enumerate(words) if rare[0] in chunk_words and rare[1] in chunk_words]
+        queries.append({"query": f"What is said about {rare[0]} and {rare[1]}?", "chunk_ids": hits})
+        if len(queries) == count:
+            break
+    return queries
+
+def run(name, search, queries, k):
+    latencies, hits, reciprocal_ranks = [], [], []
+    for query in queries:
+        start = time.perf_counter()
+        found = search(query["query"])[:k]
+        latencies.append(time.perf_counter() - start)
+        ranks = [rank for rank, doc in enumerate(found, start=1) if doc.metadata.get("chunk_id") in query["chunk_ids"]]
+        hits.append(bool(ranks))
+        reciprocal_ranks.append(1 / ranks[0] if ranks else 0.0)
+    latencies = np.array(latencies) * 1000
+    print(f"{name:>7}: hit@{k} {np.mean(hits):.3f}, MRR {np.mean(reciprocal_ranks):.3f}, "
+          f"p50 {np.percentile(latencies, 50):.2f}ms, p99 {np.percentile(latencies, 99):.2f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Vector vs BM25 vs hybrid retrieval")
+    parser.add_argument("--db", default="db", help="Chroma persist directory")
+    parser.add_argument("--bm25", default=None, help=f"BM25 index, default <db>/{DEFAULT_BM25_FILE}")
+    parser.add_argument("--backend", default=agent_retriever.VECTOR_BACKEND, choices=["chroma", "local"])
+    parser.add_argument("--queries", default=None, help="JSON query set, default generated from the corpus")
+    parser.add_argument("--count", type=int, default=100, help="generated queries")
+    parser.add_argument("--save", default=None, help="write the query set used, to reuse it across runs")
+    parser.add_argument("-k", type=int, default=6)
+    parser.add_argument("--candidates", type=int, default=agent_retriever.HYBRID_CANDIDATES)
+    parser.add_argument("--rrf-k", type=int, default=agent_retriever.RRF_K)
+    args = parser.parse_args()
+
+    bm25_path = args.bm25 or os.path.join(args.db, DEFAULT_BM25_FILE)
+    if args.queries:
+        with open(args.queries) as f:
+            queries = json.load(f)
+    else:
+        queries = generate_queries(bm25_path, args.count)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(queries, f, indent=1)
+
+    agent_retriever.CHROMA_PERSIST_DIRECTORY = args.db
+    embeddings = agent_retriever.CachedEmbeddings(
+        agent_retriever.OpenAIEmbeddings(model=agent_retriever.EMBEDDING_MODEL, openai_api_key=agent_retriever.OPENAI_API_KEY,
+                                         dimensions=agent_retriever.EMBEDDING_DIMENSIONS),
+        agent_retriever.EMBEDDING_MODEL, agent_retriever.EMBEDDING_CACHE_DIRECTORY, agent_retriever.EMBEDDING_DIMENSIONS)
+    vector_store = agent_retriever.VectorStoreFactory.create_vector_store(args.backend, embeddings)
+    lexical_index = BM25Index(bm25_path)
+    embeddings.embed_documents([query["query"] for query in queries])
+    print(f"{len(queries)} queries, {lexical_index.count()} chunks, backend {args.backend}, k={args.k}")
+
+    vector = agent_retriever.VectorStoreRetriever(vector_store=vector_store, k=args.k)
+    hybrid = agent_retriever.HybridRetriever(vector_store=vector_store, lexical_index=lexical_index, k=args.k,
+                                             candidates=args.candidates, rrf_k=args.rrf_k)
+    bm25 = agent_retriever.HybridRetriever(vector_store=vector_store, lexical_index=lexical_index, candidates=args.k)
+    run("vector", vector.invoke, queries, args.k)
+    run("bm25", bm25._lexical_search, queries, args.k)
+    run("hybrid", hybrid.invoke, queries, args.k)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# Recall vs memory for Matryoshka truncation and int8 / binary quantization of the local IVF index.
+# Recall is measured against exact search over the full-precision, full-dimension vectors, so it
+# includes what truncation loses. Run it on our own corpus with --db; without it, a synthetic corpus
+# whose signal fades along the dimensions (like a Matryoshka embedding) is used.
+#
+#   python benchmarks/bench_quantization.py --db db
+#   python benchmarks/bench_quantization.py --dimensions 3072,1024,512,256 --dtypes float32,int8,binary
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "utils"))
+from vector_index import DTYPES, IVFIndex, IVFIndexWriter
+
+def load_db(db_directory, batch_size=1000):
+    import chromadb
+    collection = chromadb.PersistentClient(path=db_directory).get_collection("langchain")
+    batches = [collection.get(include=["embeddings"], limit=batch_size, offset=offset)["embeddings"]
+               for offset in range(0, collection.count(), batch_size)]
+    return np.concatenate([np.asarray(batch, dtype=np.float32) for batch in batches])
+
+def synthetic(count, dim, topics=200, seed=0):
+    rng = np.random.default_rng(seed)
+    fade = 1 / np.sqrt(1 + np.arange(dim) / 64)
+    centers = rng.standard_normal((topics, dim)).astype(np.float32) * fade
+    vectors = centers[rng.integers(0, topics, count)] + 0.8 * fade * rng.standard_normal((count, dim)).astype(np.float32)
+    return vectors
+
+def index_bytes(directory):
+    # what a query scans (kept hot in memory) and what only rescoring touches (left on disk)
+    scanned = os.path.getsize(os.path.join(directory, "vectors.npy"))
+    full = os.path.join(directory, "full.npy")
+    return scanned, os.path.getsize(full) if os.path.exists(full) else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall vs memory of truncated and quantized indexes")
+    parser.add_argument("--db", default=None, help="existing Chroma directory, default a synthetic corpus")
+    parser.add_argument("--count", type=int, default=20000, help="synthetic vectors")
+    parser.add_argument("--dim", type=int, default=3072, help="synthetic dimensions")
+    parser.add_argument("--dimensions", default="3072,1024,512,256")
+    parser.add_argument("--dtypes", default=",".join(DTYPES))
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=6)
+    parser.add_argument("--nprobe", type=int, default=None)
+    args = parser.parse_args()
+
+    vectors = load_db(args.db) if args.db else synthetic(args.count, args.dim)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+    noise = rng.standard_normal(queries.shape).astype(np.float32)
+    queries = queries + 0.5 * noise / np.linalg.norm(noise, axis=1, keepdims=True)
+    truth = np.argsort(-(queries @ vectors.T), axis=1)[:, :args.k]
+    ids = [str(i) for i in range(len(vectors))]
+    print(f"{len(vectors)} vectors x {vectors.shape[1]} dims, {args.queries} queries, k={args.k}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = os.path.join(tmp, "index")
+        for dimensions in [int(n) for n in args.dimensions.split(",") if int(n) <= vectors.shape[1]]:
+            for dtype in args.dtypes.split(","):
+                writer = IVFIndexWriter(directory, dimensions)
+                for start in range(0, len(vectors), 4096):
+                    writer.add(ids[start:start + 4096], vectors[start:start + 4096],
+                               [""] * len(ids[start:start + 4096]), [{}] * len(ids[start:start + 4096]))
+                writer.finish(dtype=dtype)
+                index = IVFIndex(directory)
+                latencies, recall = [], []
+                for query, expected in zip(queries, truth):
+                    start = time.perf_counter()
+                    hits = index.search(query, args.k, args.nprobe)
+                    latencies.append(time.perf_counter() - start)
+                    recall.append(len({row for row, _ in hits} & set(expected.tolist())) / args.k)
+                scanned, full = index_bytes(directory)
+                latencies = np.array(latencies) * 1000
+                print(f"{dimensions:>5} dims {dtype:>8}: recall@{args.k} {np.mean(recall):.3f}, "
+                      f"scanned {scanned / 2 ** 20:7.1f} MB, rescoring copy {full / 2 ** 20:6.1f} MB, "
+                      f"p50 {np.percentile(latencies, 50):.2f}ms, p99 {np.percentile(latencies, 99):.2f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# Query latency, recall and resident memory: Chroma vs the local IVF index exported from it.
+# Each backend runs in its own process so their memory does not mix. Queries are stored vectors with
+# a little noise, so no embedding calls are made and only the index itself is measured.
+#
+#   python benchmarks/bench_vector_index.py                 # synthetic 3072-dim corpus
+#   python benchmarks/bench_vector_index.py --db db         # our own Chroma store
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "utils"))
+from vector_index import IVFIndex, export_chroma
+
+def memory_mb():
+    # anonymous memory is what the process really holds; file pages of a memory map can be dropped at any time
+    with open("/proc/self/status") as f:
+        fields = dict(line.split(":", 1) for line in f)
+    return int(fields["RssAnon"].split()[0]) / 1024, int(fields["RssFile"].split()[0]) / 1024
+
+def synthetic_db(directory, count, dim, topics=200, seed=0):
+    # chunks of the same video talk about the same few topics, so the vectors are clustered
+    import chromadb
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((topics, dim)).astype(np.float32)
+    collection = chromadb.PersistentClient(path=directory).get_or_create_collection("langchain")
+    for start in range(0, count, 1000):
+        n = min(1000, count - start)
+        vectors = centers[rng.integers(0, topics, n)] + 0.8 * rng.standard_normal((n, dim)).astype(np.float32)
+        # unit length like OpenAI embeddings, where Chroma's default L2 ranks the same as cosine
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        collection.add(ids=[f"chunk-{start + i}" for i in range(n)], embeddings=vectors.tolist(),
+                       documents=[f"chunk {start + i}" for i in range(n)],
+                       metadatas=[{"video_id": f"v{(start + i) // 40}", "start": i} for i in range(n)])
+
+def load_queries(db_directory, count, seed=0):
+    import chromadb
+    collection = chromadb.PersistentClient(path=db_directory).get_collection("langchain")
+    total = collection.count()
+    rng = np.random.default_rng(seed)
+    offsets = rng.choice(total, min(count, total), replace=False)
+    vectors = np.stack([np.asarray(collection.get(include=["embeddings"], limit=1, offset=int(offset))["embeddings"][0])
+                        for offset in offsets]).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    noise = rng.standard_normal(vectors.shape).astype(np.float32)
+    return vectors + 0.5 * noise / np.linalg.norm(noise, axis=1, keepdims=True)
+
+def run_chroma(db_directory, queries, k, results):
+    import chromadb
+    start = time.perf_counter()
+    collection = chromadb.PersistentClient(path=db_directory).get_collection("langchain")
+    collection.query(query_embeddings=[queries[0].tolist()], n_results=k)
+    opened = time.perf_counter() - start
+    latencies, ids = [], []
+    for query in queries:
+        start = time.perf_counter()
+        found = collection.query(query_embeddings=[query.tolist()], n_results=k, include=["documents", "metadatas", "distances"])
+        latencies.append(time.perf_counter() - start)
+        ids.append(found["ids"][0])
+    results.put(("chroma", opened, latencies, ids, memory_mb()))
+
+def run_local(index_directory, queries, k, nprobe, results):
+    start = time.perf_counter()
+    index = IVFIndex(index_directory)
+    index.search(queries[0], k, nprobe)
+    opened = time.perf_counter() - start
+    latencies, ids = [], []
+    for query in queries:
+        start = time.perf_counter()
+        hits = index.search(query, k, nprobe)
+        found = index.documents([row for row, _ in hits])
+        latencies.append(time.perf_counter() - start)
+        ids.append([found[row][0] for row, _ in hits])
+    results.put((f"local nprobe={nprobe or index.info['nprobe']}", opened, latencies, ids, memory_mb()))
+
+def exact_ids(index_directory, queries, k):
+    index = IVFIndex(index_directory)
+    vectors = np.asarray(index.vectors, dtype=np.float32)
+    best = np.argsort(-(queries @ vectors.T), axis=1)[:, :k]
+    found = index.documents([int(index.rows[p]) for p in np.unique(best)])
+    return [[found[int(index.rows[p])][0] for p in row] for row in best]
+
+def run(target, *args):
+    results = multiprocessing.get_context("spawn").Queue()
+    process = multiprocessing.get_context("spawn").Process(target=target, args=(*args, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Chroma vs local IVF index")
+    parser.add_argument("--db", default=None, help="existing Chroma directory, default a synthetic one")
+    parser.add_argument("--count", type=int, default=20000, help="synthetic vectors")
+    parser.add_argument("--dim", type=int, default=3072, help="synthetic dimensions")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=6)
+    parser.add_argument("--nprobe", default="0", help="comma separated, 0 is the index default")
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float16"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_directory = args.db
+        if db_directory is None:
+            db_directory = os.path.join(tmp, "db")
+            print(f"building a synthetic store: {args.count} x {args.dim}")
+            synthetic_db(db_directory, args.count, args.dim)
+        index_directory = os.path.join(tmp, "vector_index")
+        export_chroma(db_directory, index_directory, None, args.dtype)
+        queries = load_queries(db_directory, args.queries)
+        truth = exact_ids(index_directory, queries, args.k)
+
+        runs = [run(run_chroma, db_directory, queries, args.k)]
+        runs += [run(run_local, index_directory, queries, args.k, int(nprobe) or None) for nprobe in args.nprobe.split(",")]
+        for name, opened, latencies, ids, (anon_mb, file_mb) in runs:
+            latencies = np.array(latencies) * 1000
+            recall = np.mean([len(set(found) & set(expected)) / len(expected) for found, expected in zip(ids, truth)])
+            print(f"{name:>18}: open {opened:.2f}s, p50 {np.percentile(latencies, 50):.2f}ms, "
+                  f"p99 {np.percentile(latencies, 99):.2f}ms, recall@{args.k} {recall:.3f}, RSS {anon_mb:.0f} MB anon + {file_mb:.0f} MB file")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# Chat throughput against the app with 1..N uvicorn workers sharing one SQLite session store.
+# Every turn opens a new websocket, so consecutive turns of a session usually land on different
+# workers; a session counts as intact when its page still shows all of its messages at the end.
+#
+#   python benchmarks/load_test.py --workers 1,2,4 --clients 32 --turns 3
+import argparse
+import asyncio
+import json
+import os
+import re
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+try:
+    from websockets.asyncio.client import connect
+    HEADERS_ARG = "additional_headers"
+except ImportError:
+    from websockets import connect
+    HEADERS_ARG = "extra_headers"
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# user message, assistant placeholder and end of the answer each end with a scroll
+SCROLLS_PER_TURN = 3
+
+def get(url, cookie=None):
+    request = urllib.request.Request(url, headers={"Cookie": cookie} if cookie else {})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return response.read().decode(), response.headers.get("Set-Cookie")
+
+def wait_ready(base_url, workers, timeout):
+    # each request may hit a different worker, ask until enough answers in a row say ready
+    deadline = time.monotonic() + timeout
+    streak = 0
+    while streak < workers * 4:
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"server not ready after {timeout}s")
+        try:
+            get(f"{base_url}/ready")
+            streak += 1
+        except Exception:
+            streak = 0
+            time.sleep(0.5)
+
+def start_server(workers, port, session_db):
+    env = dict(os.environ, WEB_WORKERS=str(workers), PORT=str(port), SESSION_BACKEND="sqlite", SESSION_DB=session_db)
+    return subprocess.Popen([sys.executable, "main.py"], cwd=ROOT, env=env, start_new_session=True,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def stop_server(server):
+    os.killpg(server.pid, signal.SIGTERM)
+    try:
+        server.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        os.killpg(server.pid, signal.SIGKILL)
+
+async def run_turn(ws_url, cookie, question):
+    start = time.perf_counter()
+    async with connect(ws_url, **{HEADERS_ARG: {"Cookie": cookie}}) as ws:
+        await ws.send(json.dumps({"msg": question, "HEADERS": {}}))
+        scrolls = 0
+        while scrolls < SCROLLS_PER_TURN:
+            scrolls += (await ws.recv()).count("scrollToBottom")
+    return time.perf_counter() - start
+
+async def run_client(base_url, ws_url, turns, question, latencies):
+    _, cookie = await asyncio.to_thread(get, base_url)
+    cookie = cookie.split(";")[0]
+    for turn in range(turns):
+        latencies.append(await run_turn(ws_url, cookie, f"{question} ({turn})"))
+    page, _ = await asyncio.to_thread(get, base_url, cookie)
+    return len(set(re.findall(r'id="chat-message-(\d+)"', page))) == turns * 2
+
+async def run_load(base_url, ws_url, clients, turns, question):
+    latencies = []
+    start = time.perf_counter()
+    intact = await asyncio.gather(*[run_client(base_url, ws_url, turns, question, latencies) for _ in range(clients)])
+    return time.perf_counter() - start, latencies, sum(intact)
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat throughput with several uvicorn workers")
+    parser.add_argument("--workers", default="1,2,4", help="comma separated worker counts")
+    parser.add_argument("--clients", type=int, default=32, help="concurrent chat sessions")
+    parser.add_argument("--turns", type=int, default=3, help="questions per session")
+    parser.add_argument("--port", type=int, default=5101)
+    parser.add_argument("--question", default="How does light exposure in the morning affect sleep?")
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    ws_url = f"ws://127.0.0.1:{args.port}/wscon"
+    baseline = None
+    for workers in [int(n) for n in args.workers.split(",")]:
+        with tempfile.TemporaryDirectory() as tmp:
+            server = start_server(workers, args.port, os.path.join(tmp, "sessions.sqlite"))
+            try:
+                wait_ready(base_url, workers, args.startup_timeout)
+                elapsed, latencies, intact = asyncio.run(run_load(base_url, ws_url, args.clients, args.turns, args.question))
+            finally:
+                stop_server(server)
+        throughput = len(latencies) / elapsed
+        baseline = baseline or throughput
+        p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0]
+        print(f"workers={workers}: {throughput:.2f} turns/s ({throughput / baseline:.2f}x), "
+              f"p50 {statistics.median(latencies):.2f}s, p95 {p95:.2f}s, "
+              f"{intact}/{args.clients} sessions intact")
+
+if __name__ == "__main__":
+    main()
@@ -7,4 +7,11 @@ tlink = Script(src="https://cdn.tailwindcss.com")
 dlink = Link(rel="stylesheet", href="https://cdn.jsdelivr.net/npm/daisyui@4.11.1/dist/full.min.css")
 auto_scroll_script = Script(js_content)
 
-app = FastHTML(hdrs=(tlink, dlink, picolink, auto_scroll_script), ws_hdr=True)
\ No newline at end of file
+# called once the event loop runs; hooks should schedule slow work rather than block serving
+startup_hooks = []
+
+async def startup():
+    for hook in startup_hooks:
+        hook()
+
+app = FastHTML(hdrs=(tlink, dlink, picolink, auto_scroll_script), ws_hdr=True, on_startup=[startup])
\ No newline at end of file
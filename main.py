@@ -1,5 +1,20 @@
+import os
 from fasthtml.common import *
+
+# WEB_WORKERS > 1 runs that many uvicorn worker processes; they keep no conversation state of their own,
+# messages, agent history and summaries all live in the shared session store
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", 1))
+if WEB_WORKERS > 1:
+    os.environ.setdefault("SESSION_BACKEND", "sqlite")
+    if os.environ["SESSION_BACKEND"] == "memory":
+        raise ValueError("WEB_WORKERS > 1 needs a shared SESSION_BACKEND, not memory")
+
 from config import app
 import views.chat_view  # This import is necessary to register the routes
 
-serve()
\ No newline at end of file
+if WEB_WORKERS > 1:
+    if __name__ == "__main__":
+        import uvicorn
+        uvicorn.run("main:app", host=os.getenv("HOST", "0.0.0.0"), port=int(os.getenv("PORT", 5001)), workers=WEB_WORKERS)
+else:
+    serve()
@@ -1,5 +1,9 @@
-from agents.agent_retriever import HubeGPT
-from langchain_core.messages import AIMessageChunk
+import asyncio
+import re
+import threading
+import time
+from agents.session_store import create_session_store
+from utils.youtube_utils import source_url
 
 # PROVIDER = "anthropic"
 # MODEL = "claude-3-5-sonnet-20240620"
@@ -7,56 +11,127 @@ from langchain_core.messages import AIMessageChunk
 PROVIDER = "openai"
 MODEL = "gpt-4o"
 
-hubegpt = HubeGPT(provider=PROVIDER, model=MODEL)
+# one HubeGPT per process, built by get_hubegpt() on startup rather than at import time
+hubegpt = None
+_hubegpt_lock = threading.Lock()
+
+def get_hubegpt():
+    global hubegpt
+    with _hubegpt_lock:
+        if hubegpt is None:
+            start = time.perf_counter()
+            # langchain, chromadb and the provider SDK are only imported here
+            from agents.agent_retriever import HubeGPT
+            imports = round(time.perf_counter() - start, 3)
+            print(f"[startup] imports: {imports:.3f}s")
+            instance = HubeGPT(provider=PROVIDER, model=MODEL)
+            instance.warm_up()
+            instance.startup_timings = {"imports": imports, **instance.startup_timings}
+            hubegpt = instance
+    return hubegpt
 
 class ChatModel:
     def __init__(self):
-        self.sessions = {}
-        self.hubegpt = hubegpt.agent_runner()
+        self.sessions = create_session_store("messages")
+        self.hubegpt = None
+        self.direct = None
+        self._starting = None
+
+    def _start(self):
+        core = get_hubegpt()
+        self.hubegpt = core.agent_runner()
+        self.direct = core.direct_runner()
+
+    def startup(self):
+        # builds HubeGPT on a thread, so the server accepts requests (and /ready answers) meanwhile
+        if self._starting is None:
+            self._starting = asyncio.get_running_loop().create_task(asyncio.to_thread(self._start))
+        return self._starting
+
+    async def wait_ready(self):
+        await self.startup()
+
+    def is_ready(self):
+        return self.direct is not None
+
+    def readiness(self):
+        status = {"ready": self.is_ready(), "startup": dict(hubegpt.startup_timings) if hubegpt else {}}
+        if self._starting is not None and self._starting.done() and self._starting.exception() is not None:
+            status["error"] = repr(self._starting.exception())
+        return status
 
     def get_messages(self, session_id):
-        return self.sessions.get(session_id, [])
+        return self.sessions.get(session_id) or []
+
+    def _append_message(self, session_id, message):
+        messages = list(self.get_messages(session_id))
+        # "n" stays stable when the store trims old messages, so it is what DOM ids are built from
+        message["n"] = messages[-1]["n"] + 1 if messages else 0
+        messages.append(message)
+        self.sessions.set(session_id, messages)
+
+    def _update_last_message(self, session_id, **fields):
+        messages = list(self.get_messages(session_id))
+        if messages:
+            messages[-1] = {**messages[-1], **fields}
+            self.sessions.set(session_id, messages)
 
     def add_user_message(self, session_id, content):
-        if session_id not in self.sessions:
-            self.sessions[session_id] = []
-        self.sessions[session_id].append({"role": "user", "content": content})
+        self._append_message(session_id, {"role": "user", "content": content})
+        if not self.is_ready():
+            return
+        # the follow-up rewrite runs while the user message and the assistant placeholder are sent
+        hubegpt.contextualize(session_id, content)
 
     def add_assistant_message(self, session_id):
-        if session_id not in self.sessions:
-            self.sessions[session_id] = []
-        self.sessions[session_id].append({"role": "assistant", "content": "", "context": []})
+        self._append_message(session_id, {"role": "assistant", "content": "", "context": []})
 
     def add_context_to_last_message(self, session_id, urls):
-        if session_id in self.sessions and self.sessions[session_id]:
-            self.sessions[session_id][-1]["context"] = urls
+        self._update_last_message(session_id, context=urls)
 
     async def stream_response(self, session_id):
+        await self.wait_ready()
         messages = self.get_messages(session_id)
         input_text = messages[-2]["content"] if len(messages) > 1 and messages[-2]['role'] == 'user' else ""
-        
-        async for log_patch in self.hubegpt.astream_log({"input": input_text}, config={"configurable": {"session_id": session_id}}):
-            for op in log_patch.ops:
-                print(op)
-                if op['op'] == 'add' and 'value' in op and isinstance(op['value'], AIMessageChunk):
-                    if PROVIDER == "anthropic":
-                        # Handle Anthropic response
-                        if isinstance(op['value'].content, list) and op['value'].content:
-                            chunk_content = op['value'].content[0].get('text', '')
-                        else:
-                            chunk_content = ''
-                    else:
-                        # Handle OpenAI response
-                        chunk_content = op['value'].content
-                        
-                    if chunk_content:
-                        self.sessions[session_id][-1]["content"] += chunk_content
-                        yield chunk_content
-
-    def get_relevant_documents(self, content):
-        return hubegpt.get_relevant_documents(content)
-    
-# chatanthropic 
-# {'op': 'add', 'path': '/logs/ChatAnthropic/streamed_output/-', 'value': AIMessageChunk(content=[{'text': 'Hello there', 'type': 'text', 'index': 0}], id='run-d450be24-70fc-4dbe-b203-5860a32c7112')}
-# chatopenai
-# {'op': 'add', 'path': '/logs/ChatOpenAI/streamed_output/-', 'value': AIMessageChunk(content='Hello', id='run-40b754c5-6201-4ba5-b702-78aa94fccd36')}
\ No newline at end of file
+
+        # follow-ups are resolved against the history first, so the cache, the router and retrieval
+        # all work on a standalone question
+        question = await hubegpt.acontextualize(session_id, input_text)
+        vector, cached = await hubegpt.alookup_answer(question)
+        if cached is not None:
+            async for chunk in self._stream_cached_answer(session_id, input_text, cached):
+                yield chunk
+            return
+
+        from agents.streaming import astream_answer, TOKEN
+        answer = []
+        documents = []
+        config = {"configurable": {"session_id": session_id}}
+        runner = self.direct if hubegpt.route(question) == "direct" else self.hubegpt
+        # the retriever's own results become the message sources, no second search needed
+        async for kind, value in astream_answer(runner, {"input": input_text, "question": question}, config):
+            if kind == TOKEN:
+                answer.append(value)
+                yield value
+            else:
+                documents.extend(value)
+
+        # written once at the end, a store outside the process should not see a write per token
+        urls = [source_url(doc.metadata) for doc in documents if "url" in doc.metadata]
+        urls = list(dict.fromkeys(urls))
+        self._update_last_message(session_id, content="".join(answer), context=urls)
+        hubegpt.answer_cache.store(vector, question, "".join(answer), urls)
+        hubegpt.after_turn(session_id)
+
+    async def _stream_cached_answer(self, session_id, input_text, cached):
+        # replay a cached answer without any LLM call, keeping the agent history in step
+        history = hubegpt.get_session_history(session_id)
+        history.add_user_message(input_text)
+        history.add_ai_message(cached["answer"])
+        for chunk in re.findall(r"\S+\s*", cached["answer"]):
+            yield chunk
+        self._update_last_message(session_id, content=cached["answer"], context=list(cached["sources"]))
+        hubegpt.after_turn(session_id)
+
+    def metrics(self):
+        return hubegpt.metrics() if self.is_ready() else {}
@@ -11,12 +11,33 @@ document.addEventListener('DOMContentLoaded', function() {
         // Initial scroll
         scrollToBottom();
 
-        // Set up MutationObserver
-        const observer = new MutationObserver(scrollToBottom);
+        // Set up MutationObserver; a page of older messages must not jump to the bottom
+        const observer = new MutationObserver(function(mutations) {
+            const historyPage = mutations.some(m => Array.from(m.addedNodes).some(
+                node => node.classList && node.classList.contains('history-page')));
+            if (!historyPage) {
+                scrollToBottom();
+            }
+        });
         observer.observe(chatlist, { childList: true, subtree: true });
 
+        // Older messages are inserted above the visible ones, keep the view where it was
+        let fromBottom = null;
+        document.body.addEventListener('htmx:beforeSwap', function(event) {
+            if (event.detail.target.classList.contains('history-loader')) {
+                fromBottom = chatlist.scrollHeight - chatlist.scrollTop;
+            }
+        });
+
         // Listen for HTMX events
-        document.body.addEventListener('htmx:afterOnLoad', scrollToBottom);
+        document.body.addEventListener('htmx:afterOnLoad', function(event) {
+            if (fromBottom !== null && event.detail.elt.classList.contains('history-loader')) {
+                chatlist.scrollTop = chatlist.scrollHeight - fromBottom;
+                fromBottom = null;
+            } else {
+                scrollToBottom();
+            }
+        });
         document.body.addEventListener('htmx:wsAfterMessage', scrollToBottom);
     }
 });
@@ -0,0 +1,95 @@
+import os
+import re
+import json
+import sqlite3
+import argparse
+import threading
+from typing import Dict, List, Tuple
+
+DEFAULT_BM25_FILE = 'bm25.sqlite'
+
+# words that match nearly every chunk; BM25 would weigh them down anyway, dropping them keeps the match set small
+STOPWORDS = set('''
+a about an and are as at be but by can do does for from had has have how i if in is it its me my no not of on or
+our so than that the their them then there these they this to was we were what when where which who why will
+with would you your
+'''.split())
+
+def to_match_query(text: str) -> str:
+    # any of the question's words, each quoted so FTS5 operators in user text stay plain words
+    words = [word for word in re.findall(r'\w+', text.lower()) if word not in STOPWORDS]
+    return ' OR '.join(f'"{word}"' for word in dict.fromkeys(words))
+
+class BM25Index:
+    # lexical index over chunks, kept next to the Chroma store: a SQLite FTS5 table (inverted index,
+    # porter stemming, bm25 ranking) keyed by chunk_id, updated in place as ingest commits chunks
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chunks USING fts5(chunk_id UNINDEXED, content, "
+                           "metadata UNINDEXED, tokenize='porter unicode61 remove_diacritics 2')")
+
+    def missing(self, chunk_ids: List[str]) -> List[str]:
+        found = set()
+        with self._lock:
+            for start in range(0, len(chunk_ids), 500):
+                batch = chunk_ids[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                found.update(row[0] for row in self._conn.execute(
+                    f'SELECT chunk_id FROM chunks WHERE chunk_id IN ({placeholders})', batch))
+        return [chunk_id for chunk_id in chunk_ids if chunk_id not in found]
+
+    def upsert(self, chunk_ids: List[str], contents: List[str], metadatas: List[Dict]):
+        if not chunk_ids:
+            return
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.executemany('DELETE FROM chunks WHERE chunk_id = ?', [(chunk_id,) for chunk_id in chunk_ids])
+                self._conn.executemany('INSERT INTO chunks VALUES (?, ?, ?)', [
+                    (chunk_id, content, json.dumps(metadata or {}, separators=(',', ':')))
+                    for chunk_id, content, metadata in zip(chunk_ids, contents, metadatas)])
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def search(self, query: str, k: int) -> List[Tuple[str, str, Dict, float]]:
+        # (chunk_id, content, metadata, score), best first; FTS5's bm25() is lower for better matches
+        match = to_match_query(query)
+        if not match:
+            return []
+        with self._lock:
+            rows = self._conn.execute('SELECT chunk_id, content, metadata, bm25(chunks) FROM chunks WHERE chunks MATCH ? '
+                                      'ORDER BY bm25(chunks) LIMIT ?', (match, k)).fetchall()
+        return [(chunk_id, content, json.loads(metadata), -score) for chunk_id, content, metadata, score in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM chunks').fetchone()[0]
+
+def rebuild_from_chroma(db_directory: str, path: str, batch_size: int = 1000):
+    # backfill for stores ingested before the lexical index existed
+    import chromadb
+    collection = chromadb.PersistentClient(path=db_directory).get_collection('langchain')
+    index = BM25Index(path)
+    total = collection.count()
+    for offset in range(0, total, batch_size):
+        batch = collection.get(include=['documents', 'metadatas'], limit=batch_size, offset=offset)
+        metadatas = batch['metadatas']
+        index.upsert([metadata.get('chunk_id', id) for id, metadata in zip(batch['ids'], metadatas)],
+                     batch['documents'], metadatas)
+        print(f'[bm25] {min(offset + batch_size, total)}/{total} chunks indexed')
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the BM25 index from the Chroma store')
+    parser.add_argument('--db', default='db', help='Chroma persist directory')
+    parser.add_argument('--out', default=None, help=f'index file, default <db>/{DEFAULT_BM25_FILE}')
+    args = parser.parse_args()
+    rebuild_from_chroma(args.db, args.out or os.path.join(args.db, DEFAULT_BM25_FILE))
+
+if __name__ == '__main__':
+    main()
@@ -1,46 +1,153 @@
 # credits to https://github.com/nbonamy/rag-youtube/blob/main/src/download_captions.py
 import os
-import sys
 import json
 import html
+import time
+import argparse
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from downloader import Downloader
 
-def main():
+class Manifest:
+
+  # video id -> download status, persisted so interrupted backfills resume where they stopped.
+  # 'missing' is only final for a while: new uploads get their auto captions hours after publishing
+  def __init__(self, filename, missing_retry_after=6 * 3600):
+    self.filename = filename
+    self.missing_retry_after = missing_retry_after
+    self._lock = threading.Lock()
+    self.entries = json.load(open(filename)) if os.path.exists(filename) else {}
+
+  def is_done(self, id):
+    entry = self.entries.get(id)
+    if entry is None:
+      # captions downloaded before the manifest existed
+      return os.path.exists(f'captions/{id}.original.vtt')
+    if entry['status'] == 'missing':
+      return time.time() - entry.get('checked', 0) < self.missing_retry_after
+    return entry['status'] == 'downloaded'
+
+  def record(self, id, status, attempts):
+    with self._lock:
+      self.entries[id] = { 'status': status, 'attempts': attempts, 'checked': time.time() }
+      tmp = f'{self.filename}.tmp'
+      with open(tmp, 'w') as f:
+        json.dump(self.entries, f)
+      os.replace(tmp, self.filename)
+
+class Politeness:
+
+  # minimum delay between two requests to the host, shared by all workers
+  def __init__(self, delay):
+    self.delay = delay
+    self._lock = threading.Lock()
+    self._next = 0
+
+  def wait(self):
+    with self._lock:
+      now = time.monotonic()
+      start = max(now, self._next)
+      self._next = start + self.delay
+    time.sleep(start - now)
+
+def download_one(downloader, politeness, id, lang, retries):
+  for attempt in range(1, retries + 2):
+    politeness.wait()
+    try:
+      original = downloader.download_captions(id, lang)
+    except Exception as e:
+      print(f'[youtube] attempt {attempt} failed for {id}: {e}')
+      if attempt <= retries:
+        time.sleep(min(30, 2 ** attempt))
+      continue
+    if original is None:
+      return 'missing', attempt
+    with open(f'captions/{id}.original.vtt', 'w') as f:
+      f.write(original)
+    return 'downloaded', attempt
+  return 'failed', retries + 1
+
+def format_eta(seconds):
+  minutes, seconds = divmod(int(seconds), 60)
+  hours, minutes = divmod(minutes, 60)
+  return f'{hours}h{minutes:02d}m{seconds:02d}s' if hours else f'{minutes}m{seconds:02d}s'
+
+def download_all(downloader, videos, lang, concurrency, delay, retries, manifest):
+  pending = [video for video in videos if not manifest.is_done(video['id']['videoId'])]
+  print(f'[youtube] {len(videos) - len(pending)} videos already done, {len(pending)} to download')
+  if not pending:
+    return
+
+  politeness = Politeness(delay)
+  start = time.monotonic()
+  with ThreadPoolExecutor(max_workers=concurrency) as pool:
+    futures = {
+      pool.submit(download_one, downloader, politeness, video['id']['videoId'], lang, retries): video
+      for video in pending
+    }
+    for done, future in enumerate(as_completed(futures), 1):
+      video = futures[future]
+      id = video['id']['videoId']
+      status, attempts = future.result()
+      manifest.record(id, status, attempts)
+      elapsed = time.monotonic() - start
+      eta = elapsed / done * (len(pending) - done)
+      print(f'[youtube] {done}/{len(pending)} {status} {id}: {video["snippet"]["title"]} ({done / elapsed:.2f}/s, ETA {format_eta(eta)})')
+
+def prepare_one(downloader, video):
+  id = video['id']['videoId']
+  if not os.path.exists(f'captions/{id}.original.vtt'):
+    return None
+  original = open(f'captions/{id}.original.vtt', 'r').read()
+  prepared, timestamps = downloader.prepare_captions(video, original, with_timestamps=True)
+  with open(f'captions/{id}.cleaned.vtt', 'w') as f:
+    f.write(prepared)
+  with open(f'captions/{id}.timestamps.json', 'w') as f:
+    json.dump(timestamps, f, separators=(',', ':'))
+  return id
+
+def prepare_all(downloader, videos, workers):
+  prepare = partial(prepare_one, downloader)
+  if workers > 1:
+    # cleaning is CPU bound, shard it across processes; map keeps videos.json order
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+      results = list(pool.map(prepare, videos, chunksize=max(1, len(videos) // (workers * 8))))
+  else:
+    results = map(prepare, videos)
+  for video, id in zip(videos, results):
+    if id is not None:
+      print(f'[youtube] prepared captions for {id}: {video["snippet"]["title"]}')
+
+def main(downloader=None):
 
   # init
-  downloader = Downloader()
+  downloader = downloader or Downloader()
   if not os.path.exists('captions'):
     os.mkdir('captions')
 
-  # lang
-  lang = None if len(sys.argv) == 1 else sys.argv[1]
+  # args
+  parser = argparse.ArgumentParser(description='Download and clean captions for the videos in videos.json')
+  parser.add_argument('lang', nargs='?', default=None)
+  parser.add_argument('--concurrency', type=int, default=4, help='parallel downloads')
+  parser.add_argument('--delay', type=float, default=1.0, help='seconds between two requests to YouTube')
+  parser.add_argument('--retries', type=int, default=3, help='retries per video')
+  parser.add_argument('--manifest', default='captions/manifest.json')
+  parser.add_argument('--missing-retry-hours', type=float, default=6, help='look again for captions missing this long ago, 0 on every run')
+  parser.add_argument('--workers', type=int, default=1, help='processes used to clean captions')
+  args = parser.parse_args()
 
   videos = json.load(open('videos.json'))
   for video in videos:
-
     # clean
     video['snippet']['title'] = html.unescape(video['snippet']['title'])
 
-    # get info
-    id = video['id']['videoId']
-    title = video['snippet']['title']
+  # download
+  manifest = Manifest(args.manifest, args.missing_retry_hours * 3600)
+  download_all(downloader, videos, args.lang, args.concurrency, args.delay, args.retries, manifest)
 
-    # do not process if already downloaded
-    if os.path.exists(f'captions/{id}.original.vtt'):
-      original = open(f'captions/{id}.original.vtt', 'r').read()
-    else:
-      print(f'[youtube] downloading captions for {id}: {title}...')
-      original = downloader.download_captions(id, lang)
-      if original is None:
-        continue
-      with open(f'captions/{id}.original.vtt', 'w') as f:
-        f.write(original)
-
-    # prepare captions
-    print(f'[youtube] preparing captions for {id}: {title}...')
-    prepared = downloader.prepare_captions(video, original)
-    with open(f'captions/{id}.cleaned.vtt', 'w') as f:
-      f.write(prepared)
+  # prepare captions
+  prepare_all(downloader, videos, args.workers)
 
 if __name__ == '__main__':
   main()
@@ -1,17 +1,30 @@
 # credits to https://github.com/nbonamy/rag-youtube/blob/main/src/download_captions.py
+import io
 import os
 import re
 import tempfile
 from yt_dlp import YoutubeDL
 
+# every removal the original multi-pass cleaner made, as one alternation applied in a single scan.
+# Inline tags and whole header / cue timing lines never overlap, so the timed cleaner can remove the
+# lines one by one (noting each cue's time) and the tags in bulk, and still get the same text
+INLINE_CLEANUP = re.compile(r'<(?:\d\d:\d\d:\d\d\.\d\d\d><c>|/c>)|\[Music\]')
+LINE_CLEANUP = re.compile(r'(\d\d):(\d\d):(\d\d)\.(\d\d\d) --> .*\n|WEBVTT\n|Kind: captions\n|Language: .*?\n')
+CLEANUP = re.compile(f'{INLINE_CLEANUP.pattern}|{LINE_CLEANUP.pattern}')
+BLOCK_SIZE = 1 << 20
+
 class Downloader:
 
+  def __init__(self, ydl_cls=YoutubeDL):
+    # ydl_cls can be swapped for a stub with the same context manager interface
+    self.ydl_cls = ydl_cls
+
   def get_info(self, url):
     ydl_opts = {
       'verbose': True,
       'quiet': True,
     }
-    with YoutubeDL(ydl_opts) as ydl:
+    with self.ydl_cls(ydl_opts) as ydl:
       return ydl.extract_info(url, download=False)
 
   def download_captions(self, url, lang=None):
@@ -22,7 +35,9 @@ class Downloader:
       return original_captions
     return None
 
-  def prepare_captions(self, info, original_captions):
+  def prepare_captions(self, info, original_captions, with_timestamps=False):
+    if with_timestamps:
+      return self._cleanup_timed_captions(original_captions)
     captions = self._cleanup_captions(original_captions)
     # captions = f'{info["snippet"]["title"]} {captions}'
     return captions
@@ -51,11 +66,82 @@ class Downloader:
     video_id = url if '=' not in url else url.split('=')[1]
 
     # download captions
-    with YoutubeDL(ydl_opts) as ydl:
+    with self.ydl_cls(ydl_opts) as ydl:
       ydl.download(url)
       return f'{tmp_dir}/{video_id}.{lang}.vtt'
 
   def _cleanup_captions(self, original_captions):
+    return self._join_lines(self._clean_lines(io.StringIO(original_captions)))
+
+  def _clean_lines(self, captions_file):
+
+    # stream the transcript in blocks of whole lines so memory stays flat on multi-hour files
+    for block in iter(lambda: captions_file.readlines(BLOCK_SIZE), []):
+      yield from CLEANUP.sub('', ''.join(block)).split('\n')
+
+  def _join_lines(self, lines):
+
+    # combine lines, skipping blanks and consecutive duplicates
+    parts = []
+    previous_line = ''
+    for line in lines:
+      line = line.strip()
+      if line != '' and previous_line != line:
+        parts.append(line)
+        previous_line = line
+    parts.append('')
+    return ' '.join(parts) if len(parts) > 1 else ''
+
+  def _cleanup_timed_captions(self, original_captions):
+
+    # same text as _cleanup_captions, plus [char_offset, ms] pairs marking where each cue starts in it
+    captions = []
+    timestamps = []
+    length = 0
+    previous_line = ''
+    for line, cue_ms in self._clean_timed_lines(io.StringIO(original_captions)):
+      line = line.strip()
+      if line != '' and previous_line != line:
+        if not timestamps or timestamps[-1][1] != cue_ms:
+          timestamps.append([length, cue_ms])
+        captions.append(line)
+        length += len(line) + 1
+        previous_line = line
+    captions.append('')
+    return ' '.join(captions) if len(captions) > 1 else '', timestamps
+
+  def _clean_timed_lines(self, captions_file):
+
+    # the CLEANUP pass of _clean_lines, noting where in the cleaned text each removed cue timing was;
+    # every line gets the time of the last cue that starts at or before it
+    cue_ms = 0
+    for block in iter(lambda: captions_file.readlines(BLOCK_SIZE), []):
+      text = ''.join(block)
+      pieces = []
+      cues = []
+      kept = 0
+      last = 0
+      for match in LINE_CLEANUP.finditer(text):
+        piece = INLINE_CLEANUP.sub('', text[last:match.start()])
+        pieces.append(piece)
+        kept += len(piece)
+        last = match.end()
+        if match.group(1) is not None:
+          hours, minutes, seconds, millis = map(int, match.groups())
+          cues.append((kept, ((hours * 60 + minutes) * 60 + seconds) * 1000 + millis))
+      pieces.append(INLINE_CLEANUP.sub('', text[last:]))
+      line_start = 0
+      next_cue = 0
+      for line in ''.join(pieces).split('\n'):
+        while next_cue < len(cues) and cues[next_cue][0] <= line_start:
+          cue_ms = cues[next_cue][1]
+          next_cue += 1
+        yield line, cue_ms
+        line_start += len(line) + 1
+
+  def _cleanup_captions_regex(self, original_captions):
+
+    # multi-pass reference implementation, kept for benchmarks/bench_cleanup.py
 
     # copy
     contents = original_captions
@@ -0,0 +1,133 @@
+import os
+import re
+import hashlib
+import sqlite3
+import threading
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_CACHE_DIR = 'embedding_cache'
+# Matryoshka truncation, read by both ingest and the app: queries must be embedded like the documents
+EMBEDDING_DIMENSIONS = int(os.getenv('EMBEDDING_DIMENSIONS', 0)) or None
+
+def cache_namespace(model: str, dimensions: Optional[int] = None) -> str:
+    return f'{model}@{dimensions}' if dimensions else model
+
+class EmbeddingCache:
+    # vectors live as float32 rows in one memory-mapped file per namespace,
+    # a small sqlite table maps (namespace, sha256(text)) -> row
+    def __init__(self, directory: str, namespace: str):
+        os.makedirs(directory, exist_ok=True)
+        self.namespace = namespace
+        self.vectors_file = os.path.join(directory, re.sub(r'[^A-Za-z0-9_.@-]', '_', namespace) + '.f32')
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(directory, 'index.sqlite'), check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS vectors (namespace TEXT, key TEXT, row INTEGER, PRIMARY KEY (namespace, key))')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS namespaces (namespace TEXT PRIMARY KEY, dim INTEGER)')
+        row = self._conn.execute('SELECT dim FROM namespaces WHERE namespace = ?', (namespace,)).fetchone()
+        self.dim: Optional[int] = row[0] if row else None
+        self._matrix = None
+
+    @staticmethod
+    def key(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _rows(self) -> int:
+        if self.dim is None or not os.path.exists(self.vectors_file):
+            return 0
+        return os.path.getsize(self.vectors_file) // (self.dim * 4)
+
+    def _view(self, min_rows: int):
+        if self._matrix is None or len(self._matrix) < min_rows:
+            self._matrix = np.memmap(self.vectors_file, dtype=np.float32, mode='r', shape=(self._rows(), self.dim))
+        return self._matrix
+
+    def get_many(self, keys: List[str]) -> List[Optional[List[float]]]:
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                found.update(self._conn.execute(
+                    f'SELECT key, row FROM vectors WHERE namespace = ? AND key IN ({placeholders})',
+                    (self.namespace, *batch)).fetchall())
+            if not found:
+                return [None] * len(keys)
+            matrix = self._view(max(found.values()) + 1)
+            return [matrix[found[key]].tolist() if key in found else None for key in keys]
+
+    def put_many(self, keys: List[str], vectors: List[List[float]]):
+        if not keys:
+            return
+        data = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            # BEGIN IMMEDIATE serializes writers across processes sharing the cache directory
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                if self.dim is None:
+                    self.dim = data.shape[1]
+                    self._conn.execute('INSERT OR IGNORE INTO namespaces VALUES (?, ?)', (self.namespace, self.dim))
+                # rows past the last one committed are leftovers of a write that never committed (a killed
+                # process, a full disk, a rollback); cut them off so the new rows land where the index says
+                last_row = self._conn.execute('SELECT MAX(row) FROM vectors WHERE namespace = ?', (self.namespace,)).fetchone()[0]
+                first_row = 0 if last_row is None else last_row + 1
+                with open(self.vectors_file, 'ab') as f:
+                    f.truncate(first_row * self.dim * 4)
+                    f.write(data.tobytes())
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO vectors VALUES (?, ?, ?)',
+                    [(self.namespace, key, first_row + i) for i, key in enumerate(keys)])
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+class CachedEmbeddings(Embeddings):
+    def __init__(self, underlying: Embeddings, model: str, directory: str = DEFAULT_CACHE_DIR,
+                 dimensions: Optional[int] = None):
+        self.underlying = underlying
+        self.cache = EmbeddingCache(directory, cache_namespace(model, dimensions))
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [EmbeddingCache.key(text) for text in texts]
+        vectors = self.cache.get_many(keys)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            # embed each distinct missing text once, even if it repeats within the batch
+            unique = list(dict.fromkeys(keys[i] for i in missing))
+            text_by_key = {keys[i]: texts[i] for i in missing}
+            fresh = self.underlying.embed_documents([text_by_key[key] for key in unique])
+            self.cache.put_many(unique, fresh)
+            fresh_by_key = dict(zip(unique, fresh))
+            for i in missing:
+                vectors[i] = fresh_by_key[keys[i]]
+        return vectors
+
+    def uncached(self, texts: List[str]) -> List[str]:
+        # the distinct texts embed_documents would send to the provider
+        keys = [EmbeddingCache.key(text) for text in texts]
+        vectors = self.cache.get_many(keys)
+        return list({key: text for key, text, vector in zip(keys, texts, vectors) if vector is None}.values())
+
+    def embed_query(self, text: str) -> List[float]:
+        key = EmbeddingCache.key(text)
+        vector = self.cache.get_many([key])[0]
+        if vector is not None:
+            self.hits += 1
+            return vector
+        self.misses += 1
+        vector = self.underlying.embed_query(text)
+        self.cache.put_many([key], [vector])
+        return vector
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return f"embedding cache: {self.hits} hits, {self.misses} misses ({rate:.0%} hit rate)"
@@ -1,4 +1,5 @@
 
+import os
 import time
 import json
 import sys
@@ -9,21 +10,46 @@ __path__ = sys.path[0]
 def now():
   return int(time.time() * 1000)
   
+class VideoCatalog:
+
+  # id -> video record index over videos.json, rebuilt only when the file changes
+  def __init__(self, filename='videos.json'):
+    self.filename = filename
+    self._mtime = None
+    self._videos = {}
+
+  def _refresh(self):
+    try:
+      mtime = os.stat(self.filename).st_mtime_ns
+    except FileNotFoundError:
+      self._mtime = None
+      self._videos = {}
+      return
+    if mtime == self._mtime:
+      return
+    with open(self.filename) as f:
+      videos = json.load(f)
+    self._videos = { video['id']['videoId']: video for video in videos }
+    self._mtime = mtime
+
+  def get(self, video_id):
+    self._refresh()
+    return self._videos.get(video_id)
+
+  def __len__(self):
+    self._refresh()
+    return len(self._videos)
+
+catalog = VideoCatalog()
+
 def get_video_info(video_id):
-  with open('videos.json') as f:
-    videos = json.load(f)
-    for video in videos:
-      if video['id']['videoId'] == video_id:
-        return video
-    return None
+  return catalog.get(video_id)
   
 def get_video_date(video_id):
-  with open('videos.json') as f:
-    videos = json.load(f)
-    for video in videos:
-      if video['id']['videoId'] == video_id:
-        return video['snippet']['publishedAt']
+  video = catalog.get(video_id)
+  if video is None:
     return None
+  return video['snippet']['publishedAt']
 
 def get_video_url(video_id):
   return f'https://www.youtube.com/watch?v={video_id}'
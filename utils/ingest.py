@@ -1,27 +1,58 @@
 import json
 import os
+import bisect
+import hashlib
+import time
+import random
+import queue
+import argparse
 import logging
-from typing import List, Dict
+import threading
+import multiprocessing
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager
+from collections import deque
+from typing import Callable, Iterable, Iterator, List, Dict, Tuple
+
+import tiktoken
 
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
+from langchain_community.document_loaders import TextLoader
 from langchain_community.vectorstores import Chroma
 from langchain_openai import OpenAIEmbeddings
+from langchain_core.documents import Document
 
 import helpers
+import embedding_cache
+import bm25_index
 import sys
 
 __path__ = sys.path[0]
 
 class Config:
     def __init__(self):
-        self.embedding_model = OpenAIEmbeddings(model="text-embedding-3-large", openai_api_key=os.getenv('OPENAI_API_KEY'))
-        self.splitter = RecursiveCharacterTextSplitter(chunk_size=2500, chunk_overlap=500)
-        self.loader = DirectoryLoader('./captions', glob="**/*.cleaned.vtt", loader_cls=TextLoader, show_progress=True)
+        self.embedding_model_name = "text-embedding-3-large"
+        self.embedding_cache_dir = embedding_cache.DEFAULT_CACHE_DIR
+        self.embedding_dimensions = embedding_cache.EMBEDDING_DIMENSIONS
+        self.embedding_model = embedding_cache.CachedEmbeddings(
+            OpenAIEmbeddings(model=self.embedding_model_name, openai_api_key=os.getenv('OPENAI_API_KEY'),
+                             openai_api_base=os.getenv('EMBEDDING_API_BASE'), dimensions=self.embedding_dimensions),
+            self.embedding_model_name, self.embedding_cache_dir, self.embedding_dimensions)
+        self.embedding_batch_size = int(os.getenv('EMBEDDING_BATCH_SIZE', 64))
+        self.embedding_concurrency = int(os.getenv('EMBEDDING_CONCURRENCY', 4))
+        self.embedding_tokens_per_minute = int(os.getenv('EMBEDDING_TOKENS_PER_MINUTE', 1_000_000))
+        self.embedding_max_retries = int(os.getenv('EMBEDDING_MAX_RETRIES', 5))
+        self.pipeline_queue_size = int(os.getenv('INGEST_QUEUE_SIZE', 8))
+        self.chunk_size = 2500
+        self.chunk_overlap = 500
+        self.workers = 1
+        self.splitter = RecursiveCharacterTextSplitter(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap, add_start_index=True)
+        self.loader_cls = TextLoader
         self.subset_only = False
         self.loaded_file = 'loaded.json'
         self.captions_dir = './captions'
         self.db_persist_directory = 'db'
+        self.bm25_file = os.path.join(self.db_persist_directory, bm25_index.DEFAULT_BM25_FILE)
         self.log_file = 'document_processing.log'
         self.log_level = logging.DEBUG
 
@@ -44,6 +75,87 @@ def setup_logger(config: Config) -> logging.Logger:
     
     return logger
 
+@contextmanager
+def timed(logger: logging.Logger, stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        logger.info(f"[timing] {stage} took {time.perf_counter() - start:.3f}s")
+
+_END_OF_STAGE = object()
+
+def pipeline_stage(name: str, fn: Callable, upstream: Iterable, logger: logging.Logger, maxsize: int) -> Iterator:
+    # runs fn over upstream items on its own thread; the bounded queue keeps at most maxsize results in flight
+    results = queue.Queue(maxsize=maxsize)
+    errors = []
+    stats = {'items': 0, 'busy': 0.0}
+
+    def run():
+        try:
+            for item in upstream:
+                start = time.perf_counter()
+                result = fn(item)
+                stats['busy'] += time.perf_counter() - start
+                stats['items'] += 1
+                results.put(result)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            results.put(_END_OF_STAGE)
+
+    started = time.perf_counter()
+    threading.Thread(target=run, name=f"ingest-{name}", daemon=True).start()
+    while (item := results.get()) is not _END_OF_STAGE:
+        yield item
+    if errors:
+        raise errors[0]
+    elapsed = time.perf_counter() - started
+    rate = stats['items'] / elapsed if elapsed else 0.0
+    logger.info(f"[throughput] {name}: {stats['items']} files in {elapsed:.2f}s ({rate:.1f} files/s), busy {stats['busy']:.2f}s")
+
+def ordered_map(executor: Executor, fn: Callable, items: Iterable, window: int) -> Iterator:
+    # like executor.map, but only keeps `window` tasks in flight so results never pile up
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+_worker_splitter = None
+
+def _init_split_worker(chunk_size: int, chunk_overlap: int):
+    global _worker_splitter
+    _worker_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True)
+
+def _read_and_split(path: str) -> Tuple[str, List[Document]]:
+    docs = TextLoader(path).load()
+    return os.path.basename(path), _worker_splitter.split_documents(docs)
+
+def chunk_id(video_id: str, ordinal: int, content: str) -> str:
+    digest = hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
+    return f"{video_id}:{ordinal}:{digest}"
+
+class CaptionTimeline:
+    # [char_offset, ms] pairs written by download_captions.py next to each cleaned caption file
+    def __init__(self, timestamps: List[List[int]]):
+        self.offsets = [offset for offset, _ in timestamps]
+        self.millis = [ms for _, ms in timestamps]
+
+    @classmethod
+    def load(cls, captions_dir: str, video_id: str):
+        path = os.path.join(captions_dir, f"{video_id}.timestamps.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def seconds_at(self, offset: int) -> int:
+        index = bisect.bisect_right(self.offsets, offset) - 1
+        return self.millis[max(index, 0)] // 1000 if self.millis else 0
+
 class FileProcessor:
     def __init__(self, config: Config, logger: logging.Logger):
         self.config = config
@@ -74,29 +186,50 @@ class DocumentProcessor:
     def __init__(self, config: Config, logger: logging.Logger):
         self.config = config
         self.logger = logger
+        self.catalog = helpers.catalog
 
-    def process_documents(self) -> List[Dict]:
-        self.logger.info("Starting document processing")
-        docs = self.config.loader.load()
-        self.logger.info(f"Loaded {len(docs)} documents")
-        splits = self.config.splitter.split_documents(docs)
-        self.logger.info(f"Created {len(splits)} splits from the documents")
-        return splits
-
-    def enrich_metadata(self, all_splits: List[Dict], files_to_process: List[str]):
-        self.logger.info(f"Enriching metadata for {len(files_to_process)} files")
-        enriched_count = 0
-        for filename in files_to_process:
-            video_id = filename.split('.')[0]
-            metadata = self._get_metadata(video_id)
-            
-            for document in all_splits:
-                if document.metadata['source'].split('/')[-1] == filename:
-                    document.metadata = metadata
-                    enriched_count += 1
-        
-        self.logger.info(f"Enriched metadata for {enriched_count} splits across all files")
-        return all_splits
+    def read(self, filename: str) -> Tuple[str, List[Document]]:
+        # captions are cleaned by download_captions.py, so reading the .cleaned.vtt file is the clean stage
+        loader = self.config.loader_cls(os.path.join(self.config.captions_dir, filename))
+        return filename, loader.load()
+
+    def split(self, item: Tuple[str, List[Document]]) -> Tuple[str, List[Document]]:
+        filename, docs = item
+        return filename, self.config.splitter.split_documents(docs)
+
+    def enrich(self, item: Tuple[str, List[Document]]) -> Tuple[str, List[Document]]:
+        filename, splits = item
+        video_id = filename.split('.')[0]
+        metadata = self._get_metadata(video_id)
+        timeline = CaptionTimeline.load(self.config.captions_dir, video_id)
+
+        for ordinal, document in enumerate(splits):
+            start_index = document.metadata.get('start_index')
+            document.metadata = dict(metadata)
+            document.metadata['chunk_id'] = chunk_id(video_id, ordinal, document.page_content)
+            if timeline is not None and start_index is not None:
+                document.metadata['start'] = timeline.seconds_at(start_index)
+                document.metadata['end'] = timeline.seconds_at(start_index + len(document.page_content) - 1)
+        return filename, splits
+
+    def _split_in_processes(self, files_to_process: Iterable[str]) -> Iterator[Tuple[str, List[Document]]]:
+        # spawn rather than fork: the pipeline already runs threads in this process
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=self.config.workers, mp_context=context, initializer=_init_split_worker,
+                                 initargs=(self.config.chunk_size, self.config.chunk_overlap)) as pool:
+            paths = (os.path.join(self.config.captions_dir, filename) for filename in files_to_process)
+            yield from ordered_map(pool, _read_and_split, paths, self.config.workers * 2)
+
+    def process_documents(self, files_to_process: Iterable[str]) -> Iterator[Tuple[str, List[Document]]]:
+        # discover -> read -> split -> enrich, each stage on its own thread behind a bounded queue
+        self.logger.info(f"Starting document processing ({len(self.catalog)} videos in catalog, {self.config.workers} workers)")
+        size = self.config.pipeline_queue_size
+        if self.config.workers > 1:
+            splits = pipeline_stage("read+split", lambda item: item, self._split_in_processes(files_to_process), self.logger, size)
+        else:
+            docs = pipeline_stage("read", self.read, files_to_process, self.logger, size)
+            splits = pipeline_stage("split", self.split, docs, self.logger, size)
+        return pipeline_stage("enrich", self.enrich, splits, self.logger, size)
 
     def _get_metadata(self, video_id: str) -> Dict:
         metadata = {
@@ -105,7 +238,7 @@ class DocumentProcessor:
             'url': helpers.get_video_url(video_id),
             'source': video_id,
         }
-        video = helpers.get_video_info(video_id)
+        video = self.catalog.get(video_id)
         if video is not None:
             metadata['title'] = video['snippet']['title']
             metadata['description'] = video['snippet']['description']
@@ -114,22 +247,151 @@ class DocumentProcessor:
             self.logger.warning(f"Could not retrieve metadata for video {video_id}")
         return metadata
 
+class TokenBudget:
+    # sliding one-minute window so concurrent batches stay under the provider's TPM limit
+    def __init__(self, tokens_per_minute: int):
+        self.tokens_per_minute = tokens_per_minute
+        self._spent = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int):
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._spent and now - self._spent[0][0] >= 60:
+                    self._spent.popleft()
+                used = sum(spent for _, spent in self._spent)
+                if used + tokens <= self.tokens_per_minute:
+                    self._spent.append((now, tokens))
+                    return
+                wait = 60 - (now - self._spent[0][0])
+            time.sleep(wait)
+
 class ChromaDBHandler:
     def __init__(self, config: Config, logger: logging.Logger):
         self.config = config
         self.logger = logger
+        self.encoding = tiktoken.get_encoding("cl100k_base")
+        self.budget = TokenBudget(config.embedding_tokens_per_minute)
+        self.lexical = bm25_index.BM25Index(config.bm25_file)
 
-    def store_documents(self, documents: List[Dict]):
-        self.logger.info(f"Storing {len(documents)} documents in ChromaDB")
+    def _existing_ids(self, db: Chroma, ids: List[str]) -> set:
+        existing = set()
+        for start in range(0, len(ids), 500):
+            existing.update(db.get(ids=ids[start:start + 500], include=[])['ids'])
+        return existing
+
+    def _embed_batch(self, batch: List[Dict]) -> List[List[float]]:
+        texts = [doc.page_content for doc in batch]
+        # cache hits cost no provider tokens; every attempt at the rest does
+        uncached = self.config.embedding_model.uncached(texts)
+        tokens = sum(len(tokens) for tokens in self.encoding.encode_batch(uncached))
+        for attempt in range(self.config.embedding_max_retries + 1):
+            if tokens:
+                self.budget.acquire(tokens)
+            try:
+                return self.config.embedding_model.embed_documents(texts)
+            except Exception as e:
+                if attempt == self.config.embedding_max_retries:
+                    raise
+                delay = min(60, 2 ** attempt) + random.random()
+                self.logger.warning(f"Embedding batch failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _commit_batch(self, db: Chroma, batch: List[Dict], vectors: List[List[float]]):
+        # langchain's Chroma only adds texts it embeds itself; these vectors were already embedded under
+        # the token budget, so they go straight to the underlying collection, which it exposes only privately
+        db._collection.upsert(
+            ids=[doc.metadata['chunk_id'] for doc in batch],
+            embeddings=vectors,
+            metadatas=[doc.metadata for doc in batch],
+            documents=[doc.page_content for doc in batch],
+        )
+        # the lexical index follows the vector store batch by batch
+        self._index_lexical(batch)
+
+    def _index_lexical(self, batch: List[Document]):
+        self.lexical.upsert([doc.metadata['chunk_id'] for doc in batch], [doc.page_content for doc in batch],
+                            [doc.metadata for doc in batch])
+
+    def store_documents(self, files: Iterable[Tuple[str, List[Document]]], on_files_committed: Callable[[List[str]], None]):
+        # embed -> upsert; a file is reported committed once every one of its chunks is in the store
+        self.logger.info("Storing documents in ChromaDB")
         try:
-            Chroma.from_documents(documents, self.config.embedding_model, persist_directory=self.config.db_persist_directory)
+            with timed(self.logger, "store"):
+                db = Chroma(persist_directory=self.config.db_persist_directory, embedding_function=self.config.embedding_model)
+                started = time.perf_counter()
+                remaining = {}
+                completed = []
+                window = deque()
+                batch = []
+                committed = skipped = 0
+                with ThreadPoolExecutor(max_workers=self.config.embedding_concurrency) as pool:
+                    for filename, splits in files:
+                        # ids are stable per chunk, so chunks committed by an interrupted run are skipped
+                        existing = self._existing_ids(db, [doc.metadata['chunk_id'] for doc in splits])
+                        pending = [doc for doc in splits if doc.metadata['chunk_id'] not in existing]
+                        skipped += len(splits) - len(pending)
+                        # chunks stored before the lexical index existed are added to it on the way
+                        unindexed = set(self.lexical.missing([doc.metadata['chunk_id'] for doc in splits if doc.metadata['chunk_id'] in existing]))
+                        if unindexed:
+                            self._index_lexical([doc for doc in splits if doc.metadata['chunk_id'] in unindexed])
+                        if not pending:
+                            completed.append(filename)
+                            continue
+                        remaining[filename] = len(pending)
+                        for doc in pending:
+                            batch.append((filename, doc))
+                            if len(batch) == self.config.embedding_batch_size:
+                                window.append((batch, pool.submit(self._embed_batch, [doc for _, doc in batch])))
+                                batch = []
+                            if len(window) > self.config.embedding_concurrency:
+                                committed += self._commit_next(db, window, remaining, completed, on_files_committed)
+                    if batch:
+                        window.append((batch, pool.submit(self._embed_batch, [doc for _, doc in batch])))
+                    while window:
+                        committed += self._commit_next(db, window, remaining, completed, on_files_committed)
+                if completed:
+                    on_files_committed(completed)
+                if committed:
+                    self._bump_ingest_version()
+                elapsed = time.perf_counter() - started
+                self.logger.info(f"[throughput] embed+upsert: {committed} chunks in {elapsed:.2f}s ({committed / elapsed if elapsed else 0.0:.1f} chunks/s), skipped {skipped} already committed")
             self.logger.info("Successfully stored documents in ChromaDB")
+            self.logger.info(self.config.embedding_model.stats())
         except Exception as e:
             self.logger.error(f"Error storing documents in ChromaDB: {str(e)}")
             raise
 
+    def _bump_ingest_version(self):
+        # read by the app to invalidate answers cached against the previous corpus
+        with open(os.path.join(self.config.db_persist_directory, 'ingest_version'), 'w') as f:
+            f.write(str(time.time()))
+
+    def _commit_next(self, db: Chroma, window: deque, remaining: Dict[str, int], completed: List[str],
+                     on_files_committed: Callable[[List[str]], None]) -> int:
+        batch, future = window.popleft()
+        docs = [doc for _, doc in batch]
+        self._commit_batch(db, docs, future.result())
+        self.logger.debug(f"Committed batch of {len(docs)} chunks")
+        for filename, _ in batch:
+            remaining[filename] -= 1
+            if remaining[filename] == 0:
+                del remaining[filename]
+                completed.append(filename)
+        if completed:
+            on_files_committed(list(completed))
+            completed.clear()
+        return len(docs)
+
 def main():
+    parser = argparse.ArgumentParser(description="Embed new caption files into the Chroma store")
+    parser.add_argument("--workers", type=int, default=1, help="processes used to read and split caption files")
+    args = parser.parse_args()
+
     config = Config()
+    config.workers = args.workers
     logger = setup_logger(config)
     logger.info("Starting document processing script")
 
@@ -138,13 +400,13 @@ def main():
     db_handler = ChromaDBHandler(config, logger)
 
     try:
-        files_to_process = file_processor.get_files_to_process()
-        all_splits = document_processor.process_documents()
-        
-        enriched_splits = document_processor.enrich_metadata(all_splits, files_to_process)
-        db_handler.store_documents(enriched_splits)
-
-        file_processor.update_processed_files(files_to_process)
+        with timed(logger, "pipeline"):
+            files_to_process = file_processor.get_files_to_process()
+            if not files_to_process:
+                logger.info("Nothing new to ingest")
+                return
+            enriched_files = document_processor.process_documents(files_to_process)
+            db_handler.store_documents(enriched_files, file_processor.update_processed_files)
         logger.info("Document processing completed successfully")
     except Exception as e:
         logger.error(f"An error occurred during processing: {str(e)}")
@@ -0,0 +1,292 @@
+import os
+import json
+import shutil
+import sqlite3
+import argparse
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_INDEX_DIR = 'vector_index'
+# how the scanned matrix is stored; int8 and binary are only a first pass, their best
+# `rescore` x k candidates are re-ranked against a float32 copy that stays on disk
+DTYPES = ['float32', 'float16', 'int8', 'binary']
+DEFAULT_RESCORE = {'int8': 4, 'binary': 16}
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+def truncate(vectors: np.ndarray, dimensions: Optional[int]) -> np.ndarray:
+    # text-embedding-3 vectors are Matryoshka embeddings: a normalized prefix is the same vector
+    # the API returns when asked for fewer dimensions
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dimensions and vectors.shape[-1] > dimensions:
+        vectors = vectors[..., :dimensions]
+    return _normalize(vectors)
+
+def _popcount(x: np.ndarray) -> np.ndarray:
+    # bits set per row of a packed uint8 matrix whose width is a multiple of 8 bytes
+    x = x.view(np.uint64)
+    x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0f0f0f0f0f0f0f0f)
+    return ((x * np.uint64(0x0101010101010101)) >> np.uint64(56)).sum(axis=1, dtype=np.int64)
+
+def _pack_bits(vectors: np.ndarray, width: int) -> np.ndarray:
+    # sign bits, zero padded to `width` bytes
+    packed = np.packbits(vectors > 0, axis=-1)
+    padding = [(0, 0)] * (packed.ndim - 1) + [(0, width - packed.shape[-1])]
+    return np.pad(packed, padding)
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, batch: int = 4096) -> np.ndarray:
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), batch):
+        block = _normalize(np.asarray(vectors[start:start + batch], dtype=np.float32))
+        labels[start:start + batch] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+def _kmeans(sample: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    # spherical k-means: cosine assignment, centroids renormalized after every update
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _assign(sample, centroids)
+        order = np.argsort(labels, kind='stable')
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(labels[order])) + 1])
+        sums = np.zeros_like(centroids)
+        sums[labels[order][starts]] = np.add.reduceat(sample[order], starts)
+        counts = np.bincount(labels, minlength=nlist)
+        empty = counts == 0
+        # an empty list takes a random point, otherwise it stays unreachable
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = _normalize(sums)
+    return centroids
+
+class IVFIndexWriter:
+    # collects (id, vector, document, metadata) rows, then builds an inverted-file index: vectors are
+    # clustered around `nlist` centroids and stored list by list in one flat matrix, so a query reads
+    # a few contiguous slices of a memory-mapped file; documents and metadata go to a sqlite side table
+    def __init__(self, directory: str, dimensions: Optional[int] = None):
+        self.directory = directory
+        self.dimensions = dimensions
+        self.build_dir = directory + '.tmp'
+        shutil.rmtree(self.build_dir, ignore_errors=True)
+        os.makedirs(self.build_dir)
+        self.raw_file = os.path.join(self.build_dir, 'raw.f32')
+        self.dim: Optional[int] = None
+        self.count = 0
+        self._conn = sqlite3.connect(os.path.join(self.build_dir, 'meta.sqlite'))
+        self._conn.execute('CREATE TABLE chunks (row INTEGER PRIMARY KEY, id TEXT, document TEXT, metadata TEXT)')
+
+    def add(self, ids: List[str], vectors: Iterable, documents: List[str], metadatas: List[Dict]):
+        data = np.asarray(vectors, dtype=np.float32)
+        if not len(data):
+            return
+        data = truncate(data, self.dimensions)
+        self.dim = self.dim or data.shape[1]
+        with open(self.raw_file, 'ab') as f:
+            f.write(data.tobytes())
+        self._conn.executemany('INSERT INTO chunks VALUES (?, ?, ?, ?)', [
+            (self.count + i, id, document, json.dumps(metadata or {}, separators=(',', ':')))
+            for i, (id, document, metadata) in enumerate(zip(ids, documents, metadatas))])
+        self.count += len(data)
+
+    def finish(self, nlist: Optional[int] = None, dtype: str = 'float32', nprobe: Optional[int] = None):
+        if not self.count:
+            raise ValueError('no vectors to index')
+        self._conn.commit()
+        self._conn.close()
+        raw = np.memmap(self.raw_file, dtype=np.float32, mode='r', shape=(self.count, self.dim))
+        nlist = min(self.count, nlist or max(1, int(np.sqrt(self.count))))
+        rng = np.random.default_rng(0)
+        sample_size = min(self.count, nlist * 64)
+        sample = np.asarray(raw[np.sort(rng.choice(self.count, sample_size, replace=False))])
+        centroids = _kmeans(sample, nlist)
+        labels = _assign(raw, centroids)
+        order = np.argsort(labels, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=nlist))])
+
+        def write(name, dtype, width, convert, source):
+            out = np.lib.format.open_memmap(os.path.join(self.build_dir, name), mode='w+', dtype=dtype,
+                                            shape=(self.count, width))
+            for start in range(0, self.count, 4096):
+                out[start:start + 4096] = convert(source[order[start:start + 4096]])
+            out.flush()
+
+        info = {'count': self.count, 'dim': self.dim, 'nlist': nlist, 'dtype': dtype,
+                'nprobe': nprobe or max(min(nlist, 4), nlist // 16)}
+        if dtype in ('float32', 'float16'):
+            write('vectors.npy', dtype, self.dim, lambda block: block, raw)
+        else:
+            write('full.npy', np.float32, self.dim, lambda block: block, raw)
+            info['rescore'] = DEFAULT_RESCORE[dtype]
+            if dtype == 'int8':
+                # symmetric per-dimension scale
+                peak = np.zeros(self.dim, dtype=np.float32)
+                for start in range(0, self.count, 4096):
+                    peak = np.maximum(peak, np.abs(raw[start:start + 4096]).max(axis=0))
+                scales = np.where(peak == 0, 1, peak / 127).astype(np.float32)
+                np.save(os.path.join(self.build_dir, 'scales.npy'), scales)
+                write('vectors.npy', np.int8, self.dim, lambda block: np.round(block / scales).astype(np.int8), raw)
+            else:
+                width = (self.dim + 63) // 64 * 8
+                write('vectors.npy', np.uint8, width, lambda block: _pack_bits(block, width), raw)
+        del raw
+        os.remove(self.raw_file)
+        np.save(os.path.join(self.build_dir, 'centroids.npy'), centroids.astype(np.float32))
+        np.save(os.path.join(self.build_dir, 'offsets.npy'), offsets.astype(np.int64))
+        np.save(os.path.join(self.build_dir, 'rows.npy'), order.astype(np.int32))
+        with open(os.path.join(self.build_dir, 'index.json'), 'w') as f:
+            json.dump(info, f)
+
+        # swap the finished index in; readers notice the new index.json and reopen
+        old = self.directory + '.old'
+        shutil.rmtree(old, ignore_errors=True)
+        if os.path.exists(self.directory):
+            os.rename(self.directory, old)
+        os.rename(self.build_dir, self.directory)
+        shutil.rmtree(old, ignore_errors=True)
+
+class IVFSnapshot:
+    # one generation of an exported index, never modified after loading: a search and the document
+    # lookup for its rows go to the same snapshot even when a re-export lands in between
+    def __init__(self, directory: str):
+        info_file = os.path.join(directory, 'index.json')
+        self.version = os.stat(info_file).st_mtime_ns
+        with open(info_file) as f:
+            self.info = json.load(f)
+        self.centroids = np.load(os.path.join(directory, 'centroids.npy'))
+        self.offsets = np.load(os.path.join(directory, 'offsets.npy'))
+        self.rows = np.load(os.path.join(directory, 'rows.npy'), mmap_mode='r')
+        self.vectors = np.load(os.path.join(directory, 'vectors.npy'), mmap_mode='r')
+        dtype = self.info['dtype']
+        self.full = np.load(os.path.join(directory, 'full.npy'), mmap_mode='r') if dtype in DEFAULT_RESCORE else None
+        self.scales = np.load(os.path.join(directory, 'scales.npy')) if dtype == 'int8' else None
+        # the files stay readable through these handles after the writer deletes the old directory
+        self._conn = sqlite3.connect(os.path.join(directory, 'meta.sqlite'), check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def search(self, vector, k: int, nprobe: Optional[int] = None, rescore: Optional[int] = None) -> List[Tuple[int, float]]:
+        # (row, cosine similarity) of the best k among the lists whose centroids are closest to the query;
+        # a longer query vector is cut to the index's dimensions
+        query = truncate(vector, self.info['dim'])
+        nlist = len(self.centroids)
+        nprobe = min(nlist, nprobe or self.info['nprobe'])
+        probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        dtype = self.info['dtype']
+        if dtype == 'int8':
+            scaled = query * self.scales
+        elif dtype == 'binary':
+            bits = _pack_bits(query, self.vectors.shape[1])
+        positions, scores = [], []
+        for c in probe:
+            start, end = self.offsets[c], self.offsets[c + 1]
+            if start == end:
+                continue
+            block = self.vectors[start:end]
+            positions.append(np.arange(start, end))
+            if dtype == 'int8':
+                scores.append(block @ scaled)
+            elif dtype == 'binary':
+                # fewer differing signs is closer
+                scores.append(-_popcount(np.bitwise_xor(block, bits)))
+            else:
+                scores.append(np.asarray(block, dtype=np.float32) @ query)
+        if not positions:
+            return []
+        positions = np.concatenate(positions)
+        scores = np.concatenate(scores)
+        if self.full is not None:
+            keep = min(len(scores), k * (rescore or self.info['rescore']))
+            candidates = np.argpartition(-scores, keep - 1)[:keep]
+            # sorted, so the float32 rows are read front to back
+            positions = np.sort(positions[candidates])
+            scores = self.full[positions] @ query
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(int(self.rows[positions[i]]), float(scores[i])) for i in best]
+
+    def documents(self, rows: List[int]) -> Dict[int, Tuple[str, str, Dict]]:
+        placeholders = ','.join('?' * len(rows))
+        with self._lock:
+            found = self._conn.execute(f'SELECT row, id, document, metadata FROM chunks WHERE row IN ({placeholders})',
+                                       rows).fetchall()
+        return {row: (id, document, json.loads(metadata)) for row, id, document, metadata in found}
+
+class IVFIndex:
+    # read side of IVFIndexWriter: centroids and list offsets in memory, vectors memory-mapped,
+    # documents fetched from the side table only for the final top k. A re-export is picked up by
+    # loading a new snapshot and swapping the single reference, queries in flight keep the old one
+    def __init__(self, directory: str = DEFAULT_INDEX_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self.snapshot = IVFSnapshot(directory)
+
+    @property
+    def info(self) -> Dict:
+        return self.snapshot.info
+
+    @property
+    def version(self) -> int:
+        return self.snapshot.version
+
+    @property
+    def rows(self) -> np.ndarray:
+        return self.snapshot.rows
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self.snapshot.vectors
+
+    def reload_if_changed(self):
+        try:
+            version = os.stat(os.path.join(self.directory, 'index.json')).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if version != self.snapshot.version:
+            with self._lock:
+                if version != self.snapshot.version:
+                    self.snapshot = IVFSnapshot(self.directory)
+
+    def current(self) -> IVFSnapshot:
+        # read once per query and used for both search() and documents()
+        self.reload_if_changed()
+        return self.snapshot
+
+    def search(self, vector, k: int, nprobe: Optional[int] = None, rescore: Optional[int] = None) -> List[Tuple[int, float]]:
+        return self.snapshot.search(vector, k, nprobe, rescore)
+
+    def documents(self, rows: List[int]) -> Dict[int, Tuple[str, str, Dict]]:
+        return self.snapshot.documents(rows)
+
+def export_chroma(db_directory: str, directory: str, nlist: Optional[int], dtype: str,
+                  dimensions: Optional[int] = None, batch_size: int = 1000):
+    import chromadb
+    client = chromadb.PersistentClient(path=db_directory)
+    # langchain_chroma's default collection
+    collection = client.get_collection('langchain')
+    writer = IVFIndexWriter(directory, dimensions)
+    total = collection.count()
+    for offset in range(0, total, batch_size):
+        batch = collection.get(include=['embeddings', 'documents', 'metadatas'], limit=batch_size, offset=offset)
+        writer.add(batch['ids'], batch['embeddings'], batch['documents'], batch['metadatas'])
+        print(f'[export] {min(offset + batch_size, total)}/{total} vectors read')
+    writer.finish(nlist=nlist, dtype=dtype)
+    print(f'[export] wrote {writer.count} vectors to {directory}')
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the Chroma store into a local IVF index')
+    parser.add_argument('--db', default='db', help='Chroma persist directory')
+    parser.add_argument('--out', default=DEFAULT_INDEX_DIR)
+    parser.add_argument('--nlist', type=int, default=None, help='number of lists, default sqrt(vectors)')
+    # float16 halves the file but numpy upcasts every scanned row, which costs more than it saves
+    parser.add_argument('--dtype', default='float32', choices=DTYPES)
+    parser.add_argument('--dimensions', type=int, default=None, help='keep only the first N dimensions')
+    args = parser.parse_args()
+    export_chroma(args.db, args.out, args.nlist, args.dtype, args.dimensions)
+
+if __name__ == '__main__':
+    main()
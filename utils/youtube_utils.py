@@ -1,7 +1,14 @@
 from fasthtml.common import *
 
+def source_url(metadata):
+    # deep-link into the video when the chunk carries its start time
+    url = metadata["url"]
+    if "start" in metadata:
+        url = f"{url}&t={int(metadata['start'])}s"
+    return url
+
 def YouTubeThumbnail(url):
-    video_id = url.split("v=")[-1]
+    video_id = url.split("v=")[-1].split("&")[0]
     thumbnail_url = f"https://img.youtube.com/vi/{video_id}/0.jpg"
     return Div(
         A(Img(src=thumbnail_url, alt="YouTube Thumbnail", cls="w-full h-auto object-cover"),
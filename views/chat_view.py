@@ -1,11 +1,17 @@
 from fasthtml.common import *
-from config import app
+from config import app, startup_hooks
 from models.chat_model import ChatModel
-from views.components import ChatMessage, ChatInput
+from views.components import ChatMessage, ChatInput, ContextFragment, MessagePage
+from views.streaming import ChunkCoalescer, TurnSender, stream_stats
+import os
 import uuid
-import asyncio
+import time
+
+# messages rendered per page of #chatlist, older ones are loaded on demand
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", 20))
 
 chat_model = ChatModel()
+startup_hooks.append(chat_model.startup)
 
 @app.route("/")
 def get(session):
@@ -16,7 +22,7 @@ def get(session):
     
     page = Body(
         H1('HubeGPT. Hubermanlab podcast Agent Retrieval'),
-        Div(*[ChatMessage(i, messages) for i in range(len(messages))],
+        Div(*MessagePage(messages, len(messages), CHAT_PAGE_SIZE),
             id="chatlist", cls="chat-box h-[73vh] overflow-y-auto"),
         Form(Group(ChatInput(), Button("Send", cls="btn btn-primary bg-blue-500 hover:bg-blue-600 text-white")),
             ws_send=session['session_id'], hx_ext="ws", ws_connect="/wscon",
@@ -26,16 +32,33 @@ def get(session):
     )
     return Title('HubiGPT'), page
 
+@app.route("/messages")
+def get(session, before: int):
+    messages = chat_model.get_messages(session.get('session_id'))
+    end = next((i for i, msg in enumerate(messages) if msg.get('n', i) >= before), len(messages))
+    return Div(*MessagePage(messages, end, CHAT_PAGE_SIZE), cls="history-page")
+
+@app.route("/metrics")
+def get():
+    return JSONResponse({**chat_model.metrics(), "streaming": stream_stats.stats()})
+
+@app.route("/ready")
+def get():
+    status = chat_model.readiness()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
 @app.ws('/wscon')
-async def ws(msg: str, send, ws):
-    session_id = ws.session_id if hasattr(ws, 'session_id') else None
+async def ws(msg: str, send, session):
+    # the conversation belongs to the HTTP session, so a reconnect (to any worker) picks it up again
+    session_id = session.get('session_id')
     if not session_id:
-        ws.session_id = str(uuid.uuid4())
-        await send("Session established")
+        await send("Session not found, please reload the page")
         return
 
-    await handle_user_message(msg, send, ws.session_id)
-    await process_assistant_response(send, ws.session_id)
+    started = time.perf_counter()
+    send = TurnSender(send)
+    await handle_user_message(msg, send, session_id)
+    await process_assistant_response(send, session_id, started)
 
 async def handle_user_message(msg: str, send, session_id: str):
     chat_model.add_user_message(session_id, msg)
@@ -44,21 +67,24 @@ async def handle_user_message(msg: str, send, session_id: str):
     await send(ChatInput())
     await send(Script("scrollToBottom();"))
 
-async def process_assistant_response(send, session_id: str):
+async def process_assistant_response(send: TurnSender, session_id: str, started: float):
     chat_model.add_assistant_message(session_id)
     messages = chat_model.get_messages(session_id)
+    msg_n = messages[-1]["n"]
     await send(Div(ChatMessage(len(messages)-1, messages), hx_swap_oob='beforeend', id="chatlist"))
     await send(Script("scrollToBottom();"))
 
-    async for chunk in chat_model.stream_response(session_id):
-        await send(Span(chunk, id=f"chat-content-{len(messages)-1}", hx_swap_oob="beforeend"))
-        await asyncio.sleep(0.01)
-        
-    documents = chat_model.get_relevant_documents(messages[-2]["content"])
-    urls = [doc[0].metadata["url"] for doc in documents if "url" in doc[0].metadata]
-    chat_model.add_context_to_last_message(session_id, urls)
-    
-    if messages[-1]["context"]:
-        await send(Div(ChatMessage(len(messages)-1, messages), hx_swap_oob='outerHTML', id=f"chat-message-{len(messages)-1}"))
-    
-    await send(Script("scrollToBottom();"))
\ No newline at end of file
+    # each awaited send holds the next frame back, tokens that arrive meanwhile are merged into it
+    coalescer = ChunkCoalescer()
+    ttft = None
+    async for frame in coalescer.stream(chat_model.stream_response(session_id)):
+        if ttft is None:
+            ttft = time.perf_counter() - started
+        await send(Span(frame, id=f"chat-content-{msg_n}", hx_swap_oob="beforeend"))
+
+    context = chat_model.get_messages(session_id)[-1]["context"]
+    if context:
+        await send(ContextFragment(msg_n, context))
+
+    await send(Script("scrollToBottom();"))
+    stream_stats.record(ttft, coalescer.frames, coalescer.chunks, send.render_seconds, send.bytes)
\ No newline at end of file
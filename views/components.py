@@ -20,6 +20,7 @@ def create_context_accordion(msg_idx, context):
 
 def ChatMessage(msg_idx, messages):
     msg = messages[msg_idx]
+    msg_idx = msg.get('n', msg_idx)
     is_user = msg['role'] == 'user'
     bubble_class = "bg-white text-gray-800 border border-gray-200"
     chat_class = f"chat-{'end' if is_user else 'start'}"
@@ -37,11 +38,28 @@ def ChatMessage(msg_idx, messages):
         accordion = create_context_accordion(msg_idx, msg['context'])
         content.append(accordion)
     
-    message_content = Div(*content, cls="message-content")
+    message_content = Div(*content, id=f"message-content-{msg_idx}", cls="message-content")
     return Div(message_content,
                id=f"chat-message-{msg_idx}",
                cls=f"chat {chat_class} mb-8 relative")
 
+def ContextFragment(msg_idx, context):
+    # appended to a message that has already been streamed, instead of re-rendering all of it
+    return Div(create_context_accordion(msg_idx, context), id=f"message-content-{msg_idx}", hx_swap_oob="beforeend")
+
+def HistoryLoader(before):
+    return Div(Button("Load earlier messages", cls="btn btn-ghost btn-sm"),
+               hx_get=f"/messages?before={before}", hx_swap="outerHTML",
+               cls="history-loader flex justify-center mb-4")
+
+def MessagePage(messages, end, page_size):
+    # the `page_size` messages before index `end`, behind a loader for older ones if there are any
+    start = max(0, end - page_size)
+    page = [ChatMessage(i, messages) for i in range(start, end)]
+    if start > 0:
+        page.insert(0, HistoryLoader(messages[start].get('n', start)))
+    return page
+
 def ChatInput():
     return Input(type="text", name='msg', id='msg-input', 
                  placeholder="AMA...", 
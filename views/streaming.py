@@ -0,0 +1,116 @@
+from collections import deque
+from typing import AsyncIterator, Optional
+import asyncio
+import math
+import os
+import statistics
+import time
+
+from fasthtml.common import to_xml
+
+STREAM_FLUSH_MS = float(os.getenv("STREAM_FLUSH_MS", 40))
+STREAM_FLUSH_BYTES = int(os.getenv("STREAM_FLUSH_BYTES", 1024))
+STREAM_MAX_PENDING_BYTES = int(os.getenv("STREAM_MAX_PENDING_BYTES", 64 * 1024))
+
+class ChunkCoalescer:
+    # turns a token stream into a few larger websocket frames: the first chunk goes out at once, later
+    # ones are held until the oldest is `window` seconds old or `max_bytes` are buffered. Chunks keep
+    # buffering while a send is in flight, so a slow client gets bigger frames rather than more of them,
+    # and past `max_pending` bytes the token stream itself waits for the client to catch up
+    def __init__(self, window: float = STREAM_FLUSH_MS / 1000, max_bytes: int = STREAM_FLUSH_BYTES,
+                 max_pending: int = STREAM_MAX_PENDING_BYTES):
+        self.window = window
+        self.max_bytes = max_bytes
+        self.max_pending = max_pending
+        self.chunks = 0
+        self.frames = 0
+
+    async def stream(self, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+        buffer = []
+        size = 0
+        done = False
+        changed = asyncio.Condition()
+
+        async def produce():
+            nonlocal size, done
+            try:
+                async for chunk in chunks:
+                    async with changed:
+                        await changed.wait_for(lambda: size < self.max_pending)
+                        buffer.append(chunk)
+                        size += len(chunk.encode())
+                        self.chunks += 1
+                        changed.notify_all()
+            finally:
+                async with changed:
+                    done = True
+                    changed.notify_all()
+
+        loop = asyncio.get_running_loop()
+        producer = loop.create_task(produce())
+        try:
+            while True:
+                async with changed:
+                    await changed.wait_for(lambda: buffer or done)
+                    if not buffer:
+                        break
+                    if self.frames:
+                        deadline = loop.time() + self.window
+                        while size < self.max_bytes and not done:
+                            remaining = deadline - loop.time()
+                            if remaining <= 0:
+                                break
+                            try:
+                                await asyncio.wait_for(changed.wait(), remaining)
+                            except asyncio.TimeoutError:
+                                break
+                    frame = "".join(buffer)
+                    buffer.clear()
+                    size = 0
+                    changed.notify_all()
+                self.frames += 1
+                yield frame
+            # re-raises whatever ended the token stream early
+            await producer
+        finally:
+            producer.cancel()
+
+class TurnSender:
+    # wraps a websocket send and renders the fragments itself, so a turn's render time and bytes are known
+    def __init__(self, send):
+        self.send = send
+        self.render_seconds = 0.0
+        self.bytes = 0
+
+    async def __call__(self, fragment):
+        start = time.perf_counter()
+        html = to_xml(fragment)
+        self.render_seconds += time.perf_counter() - start
+        self.bytes += len(html.encode())
+        await self.send(html)
+
+class StreamStats:
+    # per answer: time to first frame, frames, chunks, server render time and payload bytes,
+    # over the last `size` answers, for /metrics
+    def __init__(self, size: int = 1000):
+        self.answers = deque(maxlen=size)
+
+    def record(self, ttft: Optional[float], frames: int, chunks: int, render_seconds: float = 0.0, payload_bytes: int = 0):
+        self.answers.append((ttft, frames, chunks, render_seconds, payload_bytes))
+
+    def stats(self) -> dict:
+        if not self.answers:
+            return {"answers": 0}
+        ttfts = sorted(answer[0] for answer in self.answers if answer[0] is not None)
+        return {
+            "answers": len(self.answers),
+            "ttft_p50": round(statistics.median(ttfts), 3) if ttfts else None,
+            # nearest rank, so a handful of samples reports the slow one rather than the fastest
+            "ttft_p95": round(ttfts[math.ceil(0.95 * len(ttfts)) - 1], 3) if ttfts else None,
+            "frames_per_answer": round(statistics.mean(answer[1] for answer in self.answers), 1),
+            "chunks_per_answer": round(statistics.mean(answer[2] for answer in self.answers), 1),
+            "render_ms_per_turn": round(statistics.mean(answer[3] for answer in self.answers) * 1000, 2),
+            "bytes_per_turn": round(statistics.mean(answer[4] for answer in self.answers)),
+        }
+
+stream_stats = StreamStats()